@@ -0,0 +1,297 @@
+"""
+Benchmarks of the three solvers on seeded synthetic
+inputs:
+
+    landing_probability     LandingProbability(N) for
+                            growing board sizes N
+    buildable_words         find_buildable_words plus
+                            get_build_sequence of the
+                            longest words, on growing
+                            dictionaries
+    search_configurations   search_configurations on
+                            grids from 5x5 to 100x100
+
+Each case is run in a fresh process, repeat times,
+and reports its wall time (the fastest repeat), its
+throughput, and its peak memory: the peak resident
+memory (VmHWM) of the process running the case,
+less that of a process which only builds the
+inputs (the largest repeat).  Results are
+written as JSON with -o, and compared against a
+previous results file with -b, in which case the
+exit status is 1 if any case got slower, used more
+memory or lost throughput by more than the
+tolerance.
+
+    python run_benchmarks.py -o baseline.json
+    python run_benchmarks.py -b baseline.json
+"""
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import traceback
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for project in ['deadly_board_game', 'scrabble', 'redistricting']:
+    sys.path.insert(0, os.path.join(ROOT, project))
+
+from find_best_pos import LandingProbability
+from longest_buildable_word import find_buildable_words
+from longest_buildable_word import get_build_sequence
+from find_winning_districting import District
+from find_winning_districting import search_configurations
+from synthetic import synthetic_dictionary
+from synthetic import synthetic_voter_distribution
+
+# Differences below these are noise, whatever the ratio.
+TIME_SLACK = 0.01
+MEMORY_SLACK_MB = 5.
+
+
+def _landing_probability(params, seed):
+    N = params['N']
+
+    def run():
+        prob = LandingProbability(N)
+        prob.returnExtremePlacements(3, largest = True)
+        return N
+
+    return run, 'squares/s'
+
+
+def _buildable_words(params, seed):
+    all_words = synthetic_dictionary(params['n_words'], seed)
+    rule = params['rule']
+
+    def run():
+        buildable_words = find_buildable_words(all_words, rule)
+        for word in buildable_words[max(buildable_words)]:
+            get_build_sequence(word, buildable_words, rule)
+        return sum(len(words) for words in all_words.itervalues())
+
+    return run, 'words/s'
+
+
+def _search_configurations(params, seed):
+    size = params['size']
+    voter_distribution = synthetic_voter_distribution(size, seed)
+    init_districts = [District([(i, j) for j in range(size)])
+                      for i in range(size)]
+
+    def run():
+        random.seed(seed)
+        records = []
+        search_configurations(voter_distribution, init_districts,
+                              max_iter = params['max_iter'], vrb = False,
+                              callbacks = [records.append],
+                              metrics_interval = params['max_iter'])
+        # Throughput of the iterations alone, without building the
+        # configurations.
+        return records[-1]['iter_num'], records[-1]['wall_time']
+
+    return run, 'iterations/s'
+
+
+SUITES = {
+    'landing_probability' :
+        (_landing_probability, [{'N' : N} for N in [250, 500, 1000, 2000]]),
+    'buildable_words' :
+        (_buildable_words, [{'n_words' : n_words, 'rule' : 'ends'}
+                            for n_words in [50000, 200000, 800000]]),
+    'search_configurations' :
+        (_search_configurations, [{'size' : size, 'max_iter' : max_iter}
+                                  for size, max_iter in [(5, 2000),
+                                                         (10, 1000),
+                                                         (25, 400),
+                                                         (50, 200),
+                                                         (100, 100)]]),
+    }
+
+
+def _case_name(suite, params):
+    return suite + '/' + ','.join('%s=%s' % item
+                                  for item in sorted(params.iteritems()))
+
+
+def _peak_rss_mb():
+    """
+    Peak resident memory of this process in MB, from
+    VmHWM where /proc is available.
+    """
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on OS X, kilobytes elsewhere.
+    return peak / (1024. ** 2 if sys.platform == 'darwin' else 1024.)
+
+
+def _measure(make_run, params, seed, inputs_only, queue):
+    """
+    Body of the process running one repeat of a
+    case: builds the inputs, then times the run,
+    unless inputs_only.
+    """
+    try:
+        run, unit = make_run(params, seed)
+        if inputs_only:
+            queue.put({'peak_rss_mb' : _peak_rss_mb()})
+            return
+        gc.collect()
+        start = time.time()
+        result = run()
+        wall_time = time.time() - start
+        n_units, seconds = result if isinstance(result, tuple) \
+                           else (result, wall_time)
+        queue.put({'wall_time' : wall_time,
+                   'peak_rss_mb' : _peak_rss_mb(),
+                   'throughput' : n_units / max(seconds, 1e-9),
+                   'throughput_unit' : unit})
+    except Exception:
+        queue.put({'error' : traceback.format_exc()})
+
+
+def _run_process(suite, params, seed, inputs_only):
+    make_run, _ = SUITES[suite]
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _measure,
+                                      args = (make_run, params, seed,
+                                              inputs_only, queue))
+    process.start()
+    record = queue.get()
+    process.join()
+    if 'error' in record:
+        raise RuntimeError("benchmark %s failed:\n%s"
+                           % (_case_name(suite, params), record['error']))
+    return record
+
+
+def run_case(suite, params, seed = 0, repeat = 3):
+    """
+    Runs one case repeat times, each in a new process
+    so that peak memory is measured separately, plus
+    once building only its inputs, and returns its
+    result record.
+    """
+    inputs_rss = _run_process(suite, params, seed, True)['peak_rss_mb']
+    runs = [_run_process(suite, params, seed, False) for _ in range(repeat)]
+    peak_rss = max(run['peak_rss_mb'] for run in runs)
+    return {'suite' : suite,
+            'params' : params,
+            'wall_time' : min(run['wall_time'] for run in runs),
+            'wall_times' : [run['wall_time'] for run in runs],
+            'peak_memory_mb' : peak_rss - inputs_rss,
+            'peak_rss_mb' : peak_rss,
+            'inputs_rss_mb' : inputs_rss,
+            'throughput' : max(run['throughput'] for run in runs),
+            'throughput_unit' : runs[0]['throughput_unit']}
+
+
+def run_benchmarks(suites = None, seed = 0, repeat = 3, vrb = True):
+    """
+    Runs every case of suites (all of SUITES by
+    default) and returns the results, keyed by case
+    name, with a description of the machine.
+    """
+    if suites is None:
+        suites = sorted(SUITES)
+    results = {}
+    for suite in suites:
+        for params in SUITES[suite][1]:
+            name = _case_name(suite, params)
+            results[name] = run_case(suite, params, seed, repeat)
+            if vrb:
+                print "%-50s %9.3f s %9.1f MB %12.1f %s" \
+                    % (name, results[name]['wall_time'],
+                       results[name]['peak_memory_mb'],
+                       results[name]['throughput'],
+                       results[name]['throughput_unit'])
+    return {'metadata' : {'date' : time.strftime('%Y-%m-%d %H:%M:%S'),
+                          'python' : platform.python_version(),
+                          'numpy' : np.__version__,
+                          'platform' : platform.platform(),
+                          'processor' : platform.processor(),
+                          'seed' : seed,
+                          'repeat' : repeat},
+            'results' : results}
+
+
+def compare_results(results, baseline, tolerance = 0.25,
+                    memory_tolerance = 0.25, vrb = True):
+    """
+    Compares the cases of results present in
+    baseline (both as returned by run_benchmarks)
+    and returns a list of (case name, quantity, old
+    value, new value) for each regression: wall time
+    or peak memory more than 1 + tolerance (or
+    memory_tolerance) times the baseline, or
+    throughput less than the baseline divided by
+    1 + tolerance.
+    """
+    regressions = []
+    old_results = baseline['results']
+    for name, new in sorted(results['results'].iteritems()):
+        if name not in old_results:
+            continue
+        old = old_results[name]
+        if new['wall_time'] > old['wall_time'] * (1 + tolerance) and \
+           new['wall_time'] - old['wall_time'] > TIME_SLACK:
+            regressions.append((name, 'wall_time',
+                                old['wall_time'], new['wall_time']))
+        if new['peak_memory_mb'] > \
+           old['peak_memory_mb'] * (1 + memory_tolerance) and \
+           new['peak_memory_mb'] - old['peak_memory_mb'] > MEMORY_SLACK_MB:
+            regressions.append((name, 'peak_memory_mb',
+                                old['peak_memory_mb'], new['peak_memory_mb']))
+        if new['throughput'] * (1 + tolerance) < old['throughput'] and \
+           new['wall_time'] - old['wall_time'] > TIME_SLACK:
+            regressions.append((name, 'throughput',
+                                old['throughput'], new['throughput']))
+        if vrb:
+            print "%-50s time x%.2f  memory %+.1f MB  throughput x%.2f" \
+                % (name, new['wall_time'] / max(old['wall_time'], 1e-9),
+                   new['peak_memory_mb'] - old['peak_memory_mb'],
+                   new['throughput'] / max(old['throughput'], 1e-9))
+    if vrb:
+        for name, quantity, old_value, new_value in regressions:
+            print "REGRESSION", name, quantity, old_value, "->", new_value
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--suite', required = False, action = 'append',
+                        choices = sorted(SUITES))
+    parser.add_argument('-r', '--repeat', required = False, type = int,
+                        default = 3)
+    parser.add_argument('--seed', required = False, type = int, default = 0)
+    parser.add_argument('-o', '--output', required = False)
+    parser.add_argument('-b', '--baseline', required = False)
+    parser.add_argument('-t', '--tolerance', required = False, type = float,
+                        default = 0.25)
+    parser.add_argument('-m', '--memory_tolerance', required = False,
+                        type = float, default = 0.25)
+
+    args = vars(parser.parse_args())
+
+    results = run_benchmarks(args['suite'], args['seed'], args['repeat'])
+    if args['output'] is not None:
+        with open(args['output'], 'w') as fout:
+            json.dump(results, fout, indent = 2, sort_keys = True)
+        print "Results written to", args['output']
+    if args['baseline'] is not None:
+        with open(args['baseline']) as fin:
+            baseline = json.load(fin)
+        if compare_results(results, baseline, args['tolerance'],
+                           args['memory_tolerance']):
+            sys.exit(1)
@@ -0,0 +1,55 @@
+"""
+Seeded synthetic inputs for the benchmarks.  The same
+seed and sizes always give the same inputs.
+"""
+import random
+import numpy as np
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def synthetic_dictionary(n_words, seed = 0, min_length = 4,
+                         max_length = 12, grown_fraction = 0.7):
+    """
+    Returns n_words distinct words as load_words does
+    (a dictionary from word length to the set of
+    words of that length).  Words are spread evenly
+    over the lengths from min_length to max_length;
+    a fraction grown_fraction of each length is made
+    by adding a letter at either end of a shorter
+    word, so long chains of buildable words exist,
+    and the rest are random letters.  A ValueError
+    is raised if a length is too short to hold its
+    share of the words.
+    """
+    rng = random.Random(seed)
+    lengths = range(min_length, max_length + 1)
+    words = {}
+    for k, word_length in enumerate(lengths):
+        per_length = n_words // len(lengths) + \
+                     int(k < n_words % len(lengths))
+        if per_length > len(LETTERS) ** word_length // 2:
+            raise ValueError("too many words of length %d" % word_length)
+        level = set()
+        shorter = list(words.get(word_length - 1, ()))
+        n_grown = int(grown_fraction * per_length) if shorter else 0
+        while len(level) < per_length:
+            if len(level) < n_grown:
+                word = rng.choice(shorter)
+                letter = rng.choice(LETTERS)
+                word = word + letter if rng.random() < 0.5 else letter + word
+            else:
+                word = ''.join(rng.choice(LETTERS)
+                               for _ in range(word_length))
+            level.add(word)
+        words[word_length] = level
+    return words
+
+
+def synthetic_voter_distribution(size, seed = 0, one_fraction = 0.4):
+    """
+    A size x size grid of votes, each 1 with
+    probability one_fraction.
+    """
+    rng = np.random.RandomState(seed)
+    return (rng.random_sample((size, size)) < one_fraction).astype(int)
@@ -4,114 +4,646 @@ the deadly board game:
 
 http://fivethirtyeight.com/features/can-you-survive-this-deadly-board-game/
 """
+import hashlib
+import heapq
+import multiprocessing
+import numpy as np
+
+DIE_SIDES = 6
+FFT_MIN_LENGTH = 64
+PARALLEL_MIN_COLUMNS = 10000
+SHARDS_PER_PROCESS = 4
+COLUMN_BLOCK = 2 ** 16
+CACHE_LAYOUT = 2
+
+
+def dice_sum_probs(n_dice = 1, sides = DIE_SIDES):
+    """
+    Returns the step distribution for moving by the
+    sum of n_dice fair dice with the given number of
+    sides, as an array whose entry i - 1 is the
+    probability of a step of i squares.
+    """
+    die = np.concatenate([[0.], np.ones(sides) / sides])
+    probs = np.array([1.])
+    for _ in range(n_dice):
+        probs = np.convolve(probs, die)
+    return probs[1:]
+
+
+def _check_step_probs(step_probs):
+    if step_probs is None:
+        return dice_sum_probs()
+    step_probs = np.asarray(step_probs, dtype = float)
+    if step_probs.ndim != 1 or len(step_probs) == 0 or \
+       np.any(step_probs < 0) or abs(step_probs.sum() - 1.) > 1e-9:
+        raise ValueError("step_probs must be a non-empty distribution "
+                         "over steps of 1, 2, ... squares")
+    return np.trim_zeros(step_probs, 'b')
+
+
+def _binomial_table(n, k):
+    """
+    Returns an integer array B with B[x, t] = C(x, t)
+    for 0 <= x <= n and 0 <= t <= k.
+    """
+    table = np.zeros((n + 1, k + 1), dtype = np.int64)
+    table[:, 0] = 1
+    for x in range(1, n + 1):
+        table[x, 1:] = table[x - 1, 1:] + table[x - 1, :-1]
+    return table
+
+
+def _colex_rank(offsets, binom):
+    """
+    Colexicographic rank of increasing tuples of
+    positive integers given as the rows of offsets.
+    """
+    offsets = np.asarray(offsets, dtype = np.int64)
+    rank = np.zeros(offsets.shape[:-1], dtype = np.int64)
+    for t in range(offsets.shape[-1]):
+        rank += binom[offsets[..., t] - 1, t + 1]
+    return rank
+
+
+def _colex_unrank(ranks, size, binom):
+    """
+    Returns the increasing tuples of positive integers
+    with the given colexicographic ranks, as the rows
+    of an array of shape (len(ranks), size).
+    """
+    ranks = np.array(ranks, dtype = np.int64)
+    combos = np.zeros((len(ranks), size), dtype = np.int64)
+    for t in range(size, 0, -1):
+        # The t-th element is the largest x with C(x - 1, t) <= rank.
+        combos[:, t - 1] = np.searchsorted(binom[:, t], ranks,
+                                           side = 'right')
+        ranks -= binom[combos[:, t - 1] - 1, t]
+    return combos
+
+
+def _convolve(a, b):
+    n = len(a) + len(b) - 1
+    if min(len(a), len(b)) < FFT_MIN_LENGTH:
+        return np.convolve(a, b)
+    size = 1 << (n - 1).bit_length()
+    return np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size),
+                        size)[:n]
+
+
+class _CoinTable:
+    """
+    Landing probabilities for every placement of a
+    fixed number of coins, stored in one packed
+    triangular array.
+
+    A placement (pos1, ..., posk) is split into the
+    position of the first coin, which selects the
+    row, and the offsets (pos2 - pos1, ..., posk - pos1)
+    of the other coins, which select the column via
+    their colexicographic rank.  Columns are ordered
+    by the position of the last coin, so on a board
+    of N squares the valid columns of row q are the
+    first C(N - q, k - 1).
+    """
+    def __init__(self, row_lengths, values = None, row_start = None):
+        """
+        The rows may be prefixes of the rows of a table
+        for a longer board, given by its values and
+        row_start (the offset of each row in values).
+        """
+        self._max_row = len(row_lengths) - 1
+        self._row_lengths = row_lengths
+        if row_start is None:
+            row_start = np.concatenate([[0], np.cumsum(row_lengths)])
+        self._row_start = row_start
+        if values is None:
+            values = np.zeros(sum(row_lengths))
+        self._values = values
+
+    def row(self, q):
+        """
+        Returns a view of the probabilities for all
+        valid placements with the first coin at q.
+        """
+        start = self._row_start[q]
+        return self._values[start:start + self._row_lengths[q]]
+
+    def lookup(self, pos1, cols):
+        """
+        Returns the probabilities at columns cols of
+        rows pos1 (arrays of the same length).
+        """
+        return self._values[self._row_start[pos1] + cols]
+
+    def max_row(self):
+        return self._max_row
+
+    def width(self):
+        return self._row_lengths[0]
+
+    def values(self):
+        return self._values
+
+    def row_start(self):
+        return self._row_start
+
+    def nbytes(self):
+        return self._values.nbytes
+
 
 class LandingProbability:
     """
     Class for calculating the probability of
     landing on any coin for each placement
     of the coins.
+
+    The probabilities for k coins are computed
+    for every k up to n_coins.  For the full
+    n_coins, only placements with the first coin
+    at or before max_pos_first_coin are computed
+    (pass None to compute all of them).
+
+    step_probs[i - 1] is the probability of moving
+    i squares in one turn; the default is a fair
+    six-sided die (see also dice_sum_probs).
+
+    If n_processes is greater than 1, large tables
+    are filled by that many worker processes.
+
+    If a cache (see table_cache.TableCache) is given,
+    tables for the same coins and steps are loaded
+    from it when they cover a board of at least N
+    squares, and are extended to N squares and stored
+    back otherwise.
     """
-    def __init__(self, N, max_pos_first_coin = 6):
+    def __init__(self, N, max_pos_first_coin = 6, n_coins = 3,
+                 step_probs = None, n_processes = None, cache = None):
         self._N = N
         self._max_pos_first_coin = max_pos_first_coin
+        self._n_coins = n_coins
+        self._step_probs = _check_step_probs(step_probs)
+        self._n_processes = n_processes
+        self._cache = cache
         self._calculate_all()
 
     def returnPMatrix(self, n_coins):
+        """
+        Returns a dictionary from placements of
+        n_coins coins (a single position for one
+        coin, otherwise a tuple of increasing
+        positions) to the landing probability.
+        """
+        self._check_n_coins(n_coins)
+        P = {}
+        for offsets, rows in self._iter_column_blocks(n_coins):
+            for pos1, values in rows:
+                if n_coins == 1:
+                    P[pos1] = values[0]
+                    continue
+                for offset, p in zip(offsets, values):
+                    P[self._placement(n_coins, pos1, offset)] = p
+        return P
+
+    def returnP(self, positions):
+        """
+        Returns the probability of landing on any
+        coin when coins are placed on the given
+        increasing positions.
+        """
+        positions = tuple(positions)
+        n_coins = len(positions)
+        self._check_n_coins(n_coins)
+        table = self._tables[n_coins]
+        pos1 = positions[0]
+        if pos1 < 1 or pos1 > table.max_row() or positions[-1] > self._N:
+            raise ValueError("placement %s is not in the table"
+                             % (positions,))
         if n_coins == 1:
-            return {pos : p for pos, p
-                    in self._P_one_coin.iteritems()
-                    if pos > 0}
-        elif n_coins == 2:
-            return {(pos1, pos2) : p for (pos1, pos2), p
-                    in self._P_two_coins.iteritems()
-                    if pos1 > 0}
-        elif n_coins == 3:
-            return {(pos1, pos2, pos3) : p
-                    for (pos1, pos2, pos3), p
-                    in self._P_three_coins.iteritems()
-                    if pos1 > 0}
+            return table.row(pos1)[0]
+        offsets = np.array(positions[1:]) - pos1
+        if np.any(np.diff(np.concatenate([[0], offsets])) <= 0):
+            raise ValueError("positions must be increasing")
+        return table.row(pos1)[_colex_rank(offsets, self._binom)]
+
+    def returnExtremePlacements(self, n_coins, K = 1, largest = True,
+                                min_gap = 1, max_pos_first_coin = None,
+                                excluded_squares = ()):
+        """
+        Returns the K placements of n_coins coins with
+        the largest (or smallest) landing probability
+        as a list of (placement, probability) pairs,
+        most extreme first.  Only placements where
+        consecutive coins are at least min_gap squares
+        apart, the first coin is at or before
+        max_pos_first_coin and no coin is on one of
+        excluded_squares are considered.  If the table
+        for n_coins was only computed up to the
+        constructor's max_pos_first_coin, asking for a
+        later first coin raises ValueError, and
+        max_pos_first_coin = None means up to that limit.
+
+        The tables are scanned one block of columns at a
+        time while keeping only the current K candidates
+        in a heap, so no dictionary of all placements is
+        built.
+        """
+        self._check_n_coins(n_coins)
+        table = self._tables[n_coins]
+        if max_pos_first_coin is not None and \
+           max_pos_first_coin > table.max_row() and \
+           table.max_row() < self._N - (n_coins - 1):
+            raise ValueError("placements with the first coin after %d "
+                             "were not computed" % table.max_row())
+        sign = 1. if largest else -1.
+        excluded_squares = set(excluded_squares)
+        excluded = np.array(sorted(excluded_squares), dtype = np.int64)
+        heap = []
+        for offsets, rows in self._iter_column_blocks(n_coins,
+                                                      max_pos_first_coin):
+            gaps = np.diff(np.column_stack([np.zeros(len(offsets),
+                                                     dtype = np.int64),
+                                            offsets]), axis = 1)
+            gap_ok = np.all(gaps >= min_gap, axis = 1)
+            for pos1, values in rows:
+                if pos1 in excluded_squares:
+                    continue
+                mask = gap_ok[:len(values)].copy()
+                if len(excluded) > 0:
+                    mask &= ~np.any(np.in1d(pos1 + offsets[:len(values)],
+                                            excluded)
+                                    .reshape(len(values), -1), axis = 1)
+                candidates = np.flatnonzero(mask)
+                if len(candidates) > K:
+                    scores = sign * values[candidates]
+                    candidates = candidates[np.argpartition(-scores,
+                                                            K - 1)[:K]]
+                for col in candidates:
+                    item = (sign * values[col],
+                            self._placement(n_coins, pos1, offsets[col]))
+                    if len(heap) < K:
+                        heapq.heappush(heap, item)
+                    elif item > heap[0]:
+                        heapq.heapreplace(heap, item)
+        return [(placement, sign * score)
+                for score, placement in sorted(heap, reverse = True)]
+
+    def _placement(self, n_coins, pos1, offsets):
+        if n_coins == 1:
+            return pos1
+        return (pos1,) + tuple(int(pos1 + offset) for offset in offsets)
+
+    def _check_n_coins(self, n_coins):
+        if n_coins < 1 or n_coins > self._n_coins:
+            raise ValueError("n_coins must be between 1 and %d"
+                             % self._n_coins)
+
+    def _iter_column_blocks(self, n_coins, max_pos_first_coin = None):
+        """
+        Yields (offsets, rows) for consecutive blocks of
+        columns of the n_coins table, where row r of
+        offsets holds the positions of the other coins
+        relative to the first one, and rows lists
+        (pos1, values) for each first coin position
+        0 < pos1 <= max_pos_first_coin whose row reaches
+        the block, values[r] being the landing
+        probability.  The offsets are computed one block
+        at a time, so they are never all in memory.
+        """
+        table = self._tables[n_coins]
+        max_row = table.max_row()
+        if max_pos_first_coin is not None:
+            max_row = min(max_row, max_pos_first_coin)
+        for start in range(0, table.width(), COLUMN_BLOCK):
+            stop = min(start + COLUMN_BLOCK, table.width())
+            rows = []
+            for pos1 in range(1, max_row + 1):
+                values = table.row(pos1)[start:stop]
+                if len(values) == 0:
+                    break
+                rows.append((pos1, values))
+            if not rows:
+                break
+            yield _colex_unrank(np.arange(start, start + len(rows[0][1])),
+                                n_coins - 1, self._binom), rows
 
     def _calculate_all(self):
-        self._calculate_one_coin()
-        self._calculate_two_coins()
-        self._calculate_three_coins()
-
-    def _calculate_one_coin(self):
-        self._P_one_coin = {0 : 1.}
-        for pos in range(1, self._N + 1):
-            self._P_one_coin[pos] = self._calc_P_one_coin(pos)
-
-    def _calc_P_one_coin(self, pos):
-        return sum(self._get_P_one_coin(pos - i)
-                   for i in range(1, 7)) / 6.
-
-    def _get_P_one_coin(self, pos):
-        if pos >= 0:
-            return self._P_one_coin[pos]
-        else:
-            return 0.
+        cached_N, cached_values = None, None
+        if self._cache is not None:
+            cached = self._cache.load(self._cache_key())
+            if cached is not None:
+                cached_N, cached_values = cached
+        max_N = self._N if cached_N is None else max(self._N, cached_N)
+        self._binom = _binomial_table(max_N, self._n_coins)
+        self._tables = [None]
+        for n_coins in range(1, self._n_coins + 1):
+            row_lengths = self._row_lengths(self._N, n_coins)
+            if cached_N is None:
+                table = self._calculate_table(n_coins, row_lengths)
+                self._tables.append(table)
+                continue
+            previous = _CoinTable(self._row_lengths(cached_N, n_coins),
+                                  cached_values[n_coins - 1])
+            if cached_N >= self._N:
+                table = _CoinTable(row_lengths, previous.values(),
+                                   previous.row_start())
+            else:
+                table = self._calculate_table(n_coins, row_lengths, previous)
+            self._tables.append(table)
 
-    def _calculate_two_coins(self):
-        self._P_two_coins = {(0, pos) : 1.
-                             for pos in range(1, self._N + 1)}
-        for pos1 in range(1, self._N):
-            for pos2 in range(pos1 + 1, self._N + 1):
-                self._P_two_coins[(pos1, pos2)] = self._calc_P_two_coins(pos1, pos2)
+        if self._cache is not None and \
+           (cached_N is None or cached_N < self._N):
+            self._cache.store(self._cache_key(), self._N,
+                              [t.values() for t in self._tables[1:]])
 
-    def _calc_P_two_coins(self, pos1, pos2):
-        return sum(self._get_P_two_coins(pos1 - i, pos2 - i)
-                   for i in range(1, 7)) / 6.
+    def _cache_key(self):
+        params = repr((CACHE_LAYOUT, self._n_coins, self._max_pos_first_coin,
+                       self._step_probs.tolist()))
+        return hashlib.sha1(params).hexdigest()
 
-    def _get_P_two_coins(self, pos1, pos2):
+    def _row_lengths(self, N, n_coins):
+        # Row 0 is kept (empty) on a board too short for the coins.
+        max_row = max(N - (n_coins - 1), 0)
+        if n_coins == self._n_coins and \
+           self._max_pos_first_coin is not None:
+            max_row = min(max_row, self._max_pos_first_coin)
+        return [self._binom[N - q, n_coins - 1] for q in range(max_row + 1)]
+
+    def _calculate_table(self, n_coins, row_lengths, previous = None):
         """
-        Assume pos2 > pos1
+        Computes the n_coins table with the given row
+        lengths.  If previous holds the table for a
+        shorter board, only the new columns are filled.
         """
-        if pos1 >= 0:
-            return self._P_two_coins[(pos1, pos2)]
+        parallel = self._n_processes is not None and \
+                   self._n_processes > 1 and \
+                   row_lengths[0] >= PARALLEL_MIN_COLUMNS
+        if parallel:
+            shared_values = multiprocessing.RawArray('d', sum(row_lengths))
+            table = _CoinTable(row_lengths, np.frombuffer(shared_values))
         else:
-            return self._get_P_one_coin(pos2)
+            table = _CoinTable(row_lengths)
 
-    def _calculate_three_coins(self):
-        self._P_three_coins = {(0, pos2, pos3) : 1.
-                               for pos2 in range(1, self._N)
-                               for pos3 in range(pos2 + 1, self._N + 1)}
-        for pos1 in range(1, self._max_pos_first_coin + 1):
-            for pos2 in range(pos1 + 1, self._N):
-                for pos3 in range(pos2 + 1, self._N + 1):
-                    self._P_three_coins[(pos1, pos2, pos3)] = self._calc_P_three_coins(pos1, pos2, pos3)
+        table.row(0)[:] = 1.
+        if n_coins > 1:
+            self._add_passed_first_coin(table, n_coins)
+        if previous is not None:
+            _extend_columns(table, self._step_probs, previous)
+        elif parallel:
+            self._fill_parallel(table, shared_values, row_lengths)
+        else:
+            _fill_columns(table, self._step_probs, 0, table.width())
+        return table
 
-    def _calc_P_three_coins(self, pos1, pos2, pos3):
-        return sum(self._get_P_three_coins(pos1 - i, pos2 - i, pos3 - i)
-                   for i in range(1, 7)) / 6.
+    def _fill_parallel(self, table, shared_values, row_lengths):
+        """
+        Columns of a table are filled independently of
+        each other, so split them into shards of about
+        equal work and fill the shards on a process pool.
+        Workers write straight into the shared table.
+        """
+        n_shards = self._n_processes * SHARDS_PER_PROCESS
+        lengths = np.array(row_lengths[1:])
+        # Column c is updated in every row longer than c.
+        work = np.cumsum(np.searchsorted(-lengths,
+                                         -np.arange(table.width()),
+                                         side = 'left'))
+        bounds = np.searchsorted(work, np.linspace(0, work[-1],
+                                                   n_shards + 1)[1:-1])
+        bounds = np.unique(np.concatenate([[0], bounds, [table.width()]]))
+
+        pool = multiprocessing.Pool(self._n_processes,
+                                    initializer = _init_fill_worker,
+                                    initargs = (shared_values, row_lengths,
+                                                self._step_probs))
+        try:
+            pool.map(_fill_shard, zip(bounds[:-1], bounds[1:]))
+        finally:
+            pool.close()
+            pool.join()
 
-    def _get_P_three_coins(self, pos1, pos2, pos3):
+    def _add_passed_first_coin(self, table, n_coins):
         """
-        Assume pos3 > pos2 > pos1
+        A placement whose first coin has already been
+        passed has the landing probability of the
+        remaining coins.  For steps of at most D squares
+        the recurrence for rows 1, ..., D - 1 has terms
+        from first coins at -1, ..., 1 - D; add them here,
+        reading the values straight from the tables for
+        fewer coins, so the fill only needs rows q >= 0.
         """
-        if pos1 >= 0:
-            return self._P_three_coins[(pos1, pos2, pos3)]
-        else:
-            return self._get_P_two_coins(pos2, pos3)
+        D = len(self._step_probs)
+        n_rows = min(D - 1, table.max_row())
+        if n_rows < 1:
+            return
+        lower = self._tables[n_coins - 1]
+        tails = _colex_unrank(np.arange(self._binom[self._N - 1, n_coins - 2]),
+                              n_coins - 2, self._binom)
+        for gap in range(1, self._N - (n_coins - 2)):
+            # Columns whose second coin is gap squares after the first,
+            # ordered like the columns of the n_coins - 1 table.
+            n_tails = self._binom[self._N - 1 - gap, n_coins - 2]
+            cols = self._binom[gap - 1, 1] + \
+                   _colex_rank(gap + tails[:n_tails], self._binom[:, 1:])
+            for q in range(1, n_rows + 1):
+                if self._N - q - gap < n_coins - 2:
+                    break
+                n_cols = self._binom[self._N - q - gap, n_coins - 2]
+                passed = np.zeros(n_cols)
+                for i in range(q + 1, D + 1):
+                    # The first coin is at q - i, the second at gap + q - i.
+                    pos2 = gap + q - i
+                    if pos2 > 0:
+                        values = lower.row(pos2)[:n_cols]
+                    elif pos2 == 0:
+                        values = 1.
+                    else:
+                        values = self._remaining_coins(np.column_stack(
+                            [np.full(n_cols, pos2, dtype = np.int64),
+                             pos2 + tails[:n_cols]]))
+                    passed += self._step_probs[i - 1] * values
+                table.row(q)[cols[:n_cols]] += passed
+
+    def _remaining_coins(self, positions):
+        """
+        Returns the landing probability for coins on
+        each row of positions (increasing, relative to
+        the current square).  Coins behind the current
+        square have been passed, and a coin on it has
+        been landed on.
+        """
+        n_placements, n_coins = positions.shape
+        result = np.zeros(n_placements)
+        n_passed = np.sum(positions < 0, axis = 1)
+        landed = np.any(positions == 0, axis = 1)
+        result[landed] = 1.
+        for passed in range(n_coins):
+            rows = np.flatnonzero((n_passed == passed) & ~landed)
+            if len(rows) == 0:
+                continue
+            remaining = positions[rows, passed:]
+            first = remaining[:, 0]
+            cols = _colex_rank(remaining[:, 1:] - first[:, None], self._binom)
+            result[rows] = self._tables[n_coins - passed].lookup(first, cols)
+        return result
+
+
+def _fill_columns(table, step_probs, col_start, col_stop):
+    """
+    Fills columns col_start, ..., col_stop - 1 of all
+    rows q > 0 of table from the rows before them.
+    """
+    for q in range(1, table.max_row() + 1):
+        row = table.row(q)
+        stop = min(col_stop, len(row))
+        if stop <= col_start:
+            break
+        for i, p in enumerate(step_probs[:q], 1):
+            row[col_start:stop] += p * table.row(q - i)[col_start:stop]
+
+
+def _extend_columns(table, step_probs, previous):
+    """
+    Fills all rows q > 0 of table, copying the columns
+    already computed in previous (a table for a shorter
+    board) and computing only the remaining ones.
+    """
+    for q in range(1, table.max_row() + 1):
+        row = table.row(q)
+        start = 0
+        if q <= previous.max_row():
+            start = len(previous.row(q))
+            row[:start] = previous.row(q)
+        for i, p in enumerate(step_probs[:q], 1):
+            row[start:] += p * table.row(q - i)[start:len(row)]
+
+
+_worker_table = None
+_worker_step_probs = None
+
+def _init_fill_worker(shared_values, row_lengths, step_probs):
+    global _worker_table, _worker_step_probs
+    _worker_table = _CoinTable(row_lengths, np.frombuffer(shared_values))
+    _worker_step_probs = step_probs
+
+def _fill_shard(col_range):
+    _fill_columns(_worker_table, _worker_step_probs, *col_range)
+
+
+class TransferLandingProbability:
+    """
+    Landing probabilities for single placements of
+    any number of coins on arbitrarily long boards.
+
+    The probability of landing on square q before
+    reaching any coin obeys the linear recurrence
+    g(q) = sum_i step_probs[i - 1] * g(q - i), so a
+    window of the last D values is advanced by the
+    companion (transfer) matrix of the recurrence.
+    Jumping n squares at once uses x^n modulo the
+    characteristic polynomial, computed by repeated
+    squaring, which costs O(D^2 log n) instead of
+    O(D n).  Polynomial products switch to an FFT
+    for long step distributions.
+    """
+    def __init__(self, step_probs = None):
+        self._step_probs = _check_step_probs(step_probs)
+        # x^D = sum_i step_probs[i - 1] x^(D - i) modulo the
+        # characteristic polynomial, lowest power first.
+        self._reduction = self._step_probs[::-1].copy()
+
+    def returnP(self, positions):
+        """
+        Returns the probability of landing on any
+        coin when coins are placed on the given
+        increasing positions.
+        """
+        D = len(self._step_probs)
+        window = np.zeros(D)
+        window[-1] = 1.
+        last_pos = 0
+        p_hit = 0.
+        for pos in positions:
+            if pos <= last_pos:
+                raise ValueError("positions must be positive and increasing")
+            window = self._advance(window, pos - last_pos)
+            p_hit += window[-1]
+            window[-1] = 0.
+            last_pos = pos
+        return p_hit
+
+    def _advance(self, window, n):
+        """
+        Given the values of the recurrence on the D
+        squares ending at q, return its values on the
+        D squares ending at q + n.
+        """
+        D = len(window)
+        poly = self._power_of_x(n)
+        new_window = np.empty(D)
+        for t in range(D):
+            new_window[t] = np.dot(poly, window)
+            poly = self._times_x(poly)
+        return new_window
+
+    def _power_of_x(self, n):
+        """
+        Returns x^n modulo the characteristic polynomial
+        as D coefficients, lowest power first, where x^j
+        stands for the j-th value of the current window.
+        """
+        D = len(self._step_probs)
+        result = np.zeros(D)
+        result[0] = 1.
+        base = self._times_x(result)
+        while n > 0:
+            if n & 1:
+                result = self._mulmod(result, base)
+            n >>= 1
+            if n > 0:
+                base = self._mulmod(base, base)
+        return result
+
+    def _times_x(self, poly):
+        lead = poly[-1]
+        shifted = np.concatenate([[0.], poly[:-1]])
+        return shifted + lead * self._reduction
+
+    def _mulmod(self, a, b):
+        D = len(self._step_probs)
+        product = _convolve(a, b)
+        for power in range(len(product) - 1, D - 1, -1):
+            lead = product[power]
+            if lead != 0.:
+                product[power - D:power] += lead * self._reduction
+        # Every power of x reduces to a polynomial whose
+        # coefficients sum to 1 (since 1 is a root of the
+        # characteristic polynomial).  Restoring that sum
+        # stops rounding errors from doubling with every
+        # squaring.
+        return product[:D] / product[:D].sum()
 
 
 if __name__ == "__main__":
-    prob = LandingProbability(1000)
-    P = prob.returnPMatrix(3)
+    import argparse
+    from table_cache import TableCache
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-N', '--board_size', type = int, default = 1000)
+    parser.add_argument('-c', '--cache_dir', required = False)
+
+    args = vars(parser.parse_args())
+
+    cache = None
+    if args['cache_dir'] is not None:
+        cache = TableCache(args['cache_dir'])
+    prob = LandingProbability(args['board_size'], cache = cache)
 
     print "Max probability of landing on a coin:",
-    print max(P.iteritems(), key = lambda (k, v) : v)
+    print prob.returnExtremePlacements(3, largest = True)[0]
     print "Min probability of landing on a coin:",
-    print min(P.iteritems(), key = lambda (k, v) : v)
+    print prob.returnExtremePlacements(3, largest = False)[0]
 
     print "Max probability of landing on a coin if coins are separated by at least 2 spaces:",
-    print max(( ((pos1, pos2, pos3), p)
-                for ((pos1, pos2, pos3), p) in P.iteritems()
-                if pos2 - pos1 > 1 and pos3 - pos2 > 1
-                ),
-              key = lambda (k, v) : v)
+    print prob.returnExtremePlacements(3, largest = True, min_gap = 2)[0]
     print "Min probability of landing on a coin if coins are separated by at least 2 spaces:",
-    print min(( ((pos1, pos2, pos3), p)
-                for ((pos1, pos2, pos3), p) in P.iteritems()
-                if pos2 - pos1 > 1 and pos3 - pos2 > 1
-                ),
-              key = lambda (k, v) : v)
+    print prob.returnExtremePlacements(3, largest = False, min_gap = 2)[0]
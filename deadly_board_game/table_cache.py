@@ -0,0 +1,94 @@
+"""
+On-disk cache of the landing probability tables
+computed by find_best_pos.LandingProbability.
+"""
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+DEFAULT_MAX_BYTES = 2 ** 30
+META_FILE = 'meta.json'
+
+
+class TableCache:
+    """
+    Stores a list of arrays for each key, along with
+    the board size N they were computed for.  Each
+    array is kept in its own .npy file and is loaded
+    as a read-only memory map, so only the parts that
+    are used get read from disk.  Only one board size
+    is kept per key, since a table for a longer board
+    also serves all shorter ones.
+
+    When the files take more than max_bytes, the
+    least recently used entries are deleted.
+    """
+    def __init__(self, directory, max_bytes = DEFAULT_MAX_BYTES):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def load(self, key):
+        """
+        Returns (N, arrays) for key, or None if
+        nothing is cached for it.
+        """
+        entry = self._entry_dir(key)
+        meta_path = os.path.join(entry, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as fin:
+            meta = json.load(fin)
+        os.utime(meta_path, None)
+        arrays = [np.load(os.path.join(entry, name), mmap_mode = 'r')
+                  for name in meta['arrays']]
+        return meta['N'], arrays
+
+    def store(self, key, N, arrays):
+        """
+        Stores arrays for key, replacing whatever
+        was cached for it before.
+        """
+        tmp_dir = tempfile.mkdtemp(prefix = '.tmp', dir = self._directory)
+        names = []
+        for i, array in enumerate(arrays):
+            name = 'array%d.npy' % i
+            np.save(os.path.join(tmp_dir, name), array)
+            names.append(name)
+        with open(os.path.join(tmp_dir, META_FILE), 'w') as fout:
+            json.dump({'N' : N, 'arrays' : names}, fout)
+
+        entry = self._entry_dir(key)
+        if os.path.exists(entry):
+            old_dir = tempfile.mkdtemp(prefix = '.old', dir = self._directory)
+            os.rename(entry, os.path.join(old_dir, key))
+            shutil.rmtree(old_dir)
+        os.rename(tmp_dir, entry)
+        self._evict(keep = entry)
+
+    def _entry_dir(self, key):
+        return os.path.join(self._directory, key)
+
+    def _evict(self, keep):
+        entries = []
+        total_bytes = 0
+        for name in os.listdir(self._directory):
+            entry = self._entry_dir(name)
+            meta_path = os.path.join(entry, META_FILE)
+            if name.startswith('.') or not os.path.exists(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, filename))
+                       for filename in os.listdir(entry))
+            entries.append((os.path.getmtime(meta_path), size, entry))
+            total_bytes += size
+
+        for _, size, entry in sorted(entries):
+            if total_bytes <= self._max_bytes:
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry)
+            total_bytes -= size
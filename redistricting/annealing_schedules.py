@@ -0,0 +1,168 @@
+"""
+Temperature schedules for AnnealingConfiguration.
+
+A schedule gives the current temperature, and is
+told after every iteration whether the proposed
+trade was accepted and what the energy of the
+configuration now is.  get_state and set_state
+save and restore its progress as a list of numbers,
+for checkpoints.
+
+A rejection free search skips over the rejected
+iterations before an accepted trade, and passes
+their number to update as n_rejected.  max_skip
+gives the most iterations it may cover at once,
+because the temperature changes after them (None
+if there is no such limit).
+"""
+import numpy as np
+
+
+class GeometricSchedule:
+    """
+    Temperature falling geometrically from t_start
+    to t_end over n_steps iterations, then staying
+    at t_end.
+    """
+    def __init__(self, t_start = 1., t_end = 0.01, n_steps = 10000):
+        self._t_start = t_start
+        self._ratio = (float(t_end) / t_start) ** (1. / n_steps)
+        self._n_steps = n_steps
+        self.reset()
+
+    def reset(self):
+        self._step = 0
+
+    def temperature(self):
+        return self._t_start * self._ratio ** self._step
+
+    def update(self, accepted, energy, n_rejected = 0):
+        self._step = min(self._step + 1 + n_rejected, self._n_steps)
+
+    def max_skip(self):
+        # The temperature changes slowly, so a skip is drawn at
+        # the temperature it starts at.
+        return None
+
+    def get_state(self):
+        return [self._step]
+
+    def set_state(self, state):
+        self._step = int(state[0])
+
+
+class AdaptiveSchedule:
+    """
+    Temperature adjusted every window iterations so
+    that the acceptance rate follows a target which
+    falls geometrically from accept_start to
+    accept_end over n_steps iterations: the
+    temperature is multiplied by factor if the
+    acceptance rate of the last window was above
+    the target, and divided by it otherwise.
+    """
+    def __init__(self, t_start = 1., accept_start = 0.5, accept_end = 0.01,
+                 n_steps = 10000, window = 100, factor = 0.9,
+                 t_min = 1e-4):
+        self._t_start = t_start
+        self._target = GeometricSchedule(accept_start, accept_end, n_steps)
+        self._window = window
+        self._factor = factor
+        self._t_min = t_min
+        self.reset()
+
+    def reset(self):
+        self._temperature = self._t_start
+        self._target.reset()
+        self._steps = 0
+        self._accepted = 0
+
+    def temperature(self):
+        return self._temperature
+
+    def update(self, accepted, energy, n_rejected = 0):
+        for n_iterations, n_accepted in [(n_rejected, 0),
+                                         (1, int(accepted))]:
+            while n_iterations > 0:
+                n_window = min(n_iterations, self._window - self._steps)
+                self._target.update(n_accepted > 0, energy, n_window - 1)
+                self._steps += n_window
+                self._accepted += n_accepted
+                n_iterations -= n_window
+                if self._steps == self._window:
+                    self._adjust()
+
+    def max_skip(self):
+        return self._window - self._steps
+
+    def _adjust(self):
+        if float(self._accepted) / self._window > \
+           self._target.temperature():
+            self._temperature = max(self._temperature * self._factor,
+                                    self._t_min)
+        else:
+            self._temperature /= self._factor
+        self._steps = 0
+        self._accepted = 0
+
+    def get_state(self):
+        return [self._temperature, self._steps, self._accepted] + \
+               self._target.get_state()
+
+    def set_state(self, state):
+        self._temperature = float(state[0])
+        self._steps, self._accepted = int(state[1]), int(state[2])
+        self._target.set_state(state[3:])
+
+
+class ReheatingSchedule:
+    """
+    Wraps another schedule and resets it (reheats)
+    whenever the energy has not reached a new minimum
+    for patience iterations, at most max_reheats
+    times.
+    """
+    def __init__(self, schedule, patience = 2000, max_reheats = None):
+        self._schedule = schedule
+        self._patience = patience
+        self._max_reheats = max_reheats
+        self._best_energy = np.inf
+        self._since_best = 0
+        self.reheats = 0
+
+    def reset(self):
+        self._schedule.reset()
+        self._since_best = 0
+
+    def temperature(self):
+        return self._schedule.temperature()
+
+    def update(self, accepted, energy, n_rejected = 0):
+        self._schedule.update(accepted, energy, n_rejected)
+        self._since_best += n_rejected
+        if energy < self._best_energy - 1e-9:
+            self._best_energy = energy
+            self._since_best = 0
+            return
+        self._since_best += 1
+        if self._since_best >= self._patience and \
+           (self._max_reheats is None or self.reheats < self._max_reheats):
+            self.reset()
+            self.reheats += 1
+
+    def max_skip(self):
+        max_skip = self._schedule.max_skip()
+        if self._max_reheats is None or self.reheats < self._max_reheats:
+            until_reheat = self._patience - self._since_best
+            if max_skip is None or until_reheat < max_skip:
+                max_skip = until_reheat
+        return max_skip
+
+    def get_state(self):
+        return [self._best_energy, self._since_best, self.reheats] + \
+               self._schedule.get_state()
+
+    def set_state(self, state):
+        self._best_energy = float(state[0])
+        self._since_best, self.reheats = int(state[1]), int(state[2])
+        self._schedule.set_state(state[3:])
@@ -5,10 +5,25 @@ http://fivethirtyeight.com/features/rig-the-election-with-math/
 import numpy as np
 import cPickle as pickle
 from find_winning_districting import District
+from find_winning_districting import ClassicConfiguration
+from find_winning_districting import AnnealingConfiguration
 from find_winning_districting import search_configurations
+from annealing_schedules import GeometricSchedule
 
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--checkpoint', required = False)
+    parser.add_argument('-r', '--resume', required = False,
+                        action = 'store_true')
+    parser.add_argument('-a', '--anneal', required = False,
+                        action = 'store_true')
+
+    args = vars(parser.parse_args())
+    if args['resume'] and args['checkpoint'] is None:
+        parser.error("--resume needs a --checkpoint file")
+
     voter_distribution = np.array([[0] * 4 + [1, 0, 1, 1] + [0] * 6,
                                    [0, 0, 0, 1, 1, 0, 1, 1] + [0] * 6,
                                    [0] * 4 + [1, 0, 0, 1, 1, 1] + [0] * 4,
@@ -34,9 +49,21 @@ if __name__ == "__main__":
                 init_districts.append(District(current_list))
                 current_list = []
 
+    if args['anneal']:
+        ConfigurationClass = AnnealingConfiguration
+        configuration_kwargs = {'schedule' : GeometricSchedule(1., 0.02,
+                                                               10000)}
+    else:
+        ConfigurationClass = ClassicConfiguration
+        configuration_kwargs = {}
+
     max_wins, best_configuration \
         = search_configurations(voter_distribution,
-                                init_districts)
+                                init_districts,
+                                ConfigurationClass,
+                                configuration_kwargs,
+                                checkpoint_file = args['checkpoint'],
+                                resume = args['resume'])
 
     print "Max districts won in any configuration:", max_wins
     pickle.dump(best_configuration, open('best_config_classic.pkl', 'w'))
@@ -0,0 +1,331 @@
+"""
+Exact search for the districting in which 1 wins the
+most districts, for boards small enough to enumerate.
+
+The districts are built one at a time, each one
+containing the first tile (in row-major order) not
+yet in a district.  Sets of remaining tiles are
+bitmasks, and the best result for each set is
+memoized, up to the symmetries of the board that
+leave the voter distribution unchanged.  A branch is
+cut when an upper bound on its wins cannot beat the
+target.
+"""
+import time
+import numpy as np
+from find_winning_districting import District
+from find_winning_districting import _one_wins
+
+# Value of a set of tiles that cannot be split into districts.
+_INFEASIBLE = -10 ** 9
+
+
+class _TimeLimit(Exception):
+    pass
+
+
+def _grid_symmetries(voter_distribution):
+    """
+    Permutations of the tiles (tile c goes to
+    perm[c]) by the rotations and reflections of the
+    grid that map voter_distribution to itself,
+    identity excluded.
+    """
+    votes = np.asarray(voter_distribution)
+    cells = np.arange(votes.size).reshape(votes.shape)
+    transforms = [np.flipud, np.fliplr, lambda a : np.rot90(a, 2)]
+    if votes.shape[0] == votes.shape[1]:
+        transforms += [np.rot90, lambda a : np.rot90(a, 3), np.transpose,
+                       lambda a : np.rot90(a, 2).T]
+    symmetries = []
+    for transform in transforms:
+        if np.array_equal(transform(votes), votes):
+            perm = np.empty(votes.size, dtype = int)
+            perm[transform(cells).ravel()] = np.arange(votes.size)
+            symmetries.append(perm)
+    return symmetries
+
+
+class _MaskPermutation:
+    """
+    Applies a permutation of the tiles to bitmasks,
+    eight tiles at a time.
+    """
+    def __init__(self, perm):
+        self._tables = []
+        for start in range(0, len(perm), 8):
+            bits = perm[start:start + 8]
+            table = []
+            for byte in range(256):
+                mapped = 0
+                for k, bit in enumerate(bits):
+                    if byte >> k & 1:
+                        mapped |= 1 << int(bit)
+                table.append(mapped)
+            self._tables.append(table)
+
+    def __call__(self, mask):
+        mapped = 0
+        for table in self._tables:
+            mapped |= table[mask & 255]
+            mask >>= 8
+        return mapped
+
+
+class ExactDistricting:
+    """
+    Branch and bound over the partitions of a grid
+    voter_distribution into n_districts contiguous
+    districts of equal size.  solve returns the best
+    number of districts won (or tied) by 1 found, the
+    districts achieving it, and an upper bound on the
+    optimum; the two are equal unless the search
+    stopped at time_limit seconds.
+    """
+    def __init__(self, voter_distribution, n_districts, time_limit = None):
+        votes = np.asarray(voter_distribution)
+        if votes.size % n_districts != 0:
+            raise ValueError("tiles cannot be split into %d districts "
+                             "of equal size" % n_districts)
+        self._shape = votes.shape
+        self._n_tiles = votes.size
+        self._size = votes.size // n_districts
+        self._ones = sum(1 << int(node) for node in np.flatnonzero(votes))
+        self._min_one_votes = next(one_votes for one_votes
+                                   in range(self._size + 1)
+                                   if _one_wins(one_votes, self._size))
+        n_rows, n_cols = votes.shape
+        self._neighbors = []
+        for i in range(n_rows):
+            for j in range(n_cols):
+                mask = 0
+                for ni, nj in [(i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)]:
+                    if 0 <= ni < n_rows and 0 <= nj < n_cols:
+                        mask |= 1 << (ni * n_cols + nj)
+                self._neighbors.append(mask)
+        self._symmetries = [(_MaskPermutation(perm),
+                             _MaskPermutation(np.argsort(perm)))
+                            for perm in _grid_symmetries(votes)]
+        self._time_limit = time_limit
+        self._memo = {}
+        self._path = []
+        self._incumbent = _INFEASIBLE
+        self._incumbent_partition = None
+
+    def solve(self):
+        self._start_time = time.time()
+        full = (1 << self._n_tiles) - 1
+        bound = self._bound(full)
+        # Upper bound on the wins of each first district's branch.
+        branch_bounds = []
+        try:
+            for wins, district in self._candidates(full):
+                if self._incumbent >= bound:
+                    break
+                self._path.append(district)
+                value, _ = self._value(full & ~district, wins,
+                                       self._incumbent + 1 - wins)
+                self._path.pop()
+                branch_bounds.append(wins + value)
+            upper_bound = min(bound, max([self._incumbent] + branch_bounds))
+        except _TimeLimit:
+            upper_bound = bound
+        if self._incumbent_partition is None:
+            return None, [], upper_bound
+        return self._incumbent, \
+               [self._district(mask) for mask in self._incumbent_partition], \
+               upper_bound
+
+    def _value(self, mask, wins_so_far, target):
+        """
+        Returns (value, exact) for the most districts won
+        in a partition of the tiles in mask: value is
+        that number if exact, and otherwise an upper
+        bound on it below which the search was cut for
+        not reaching target or beating the best
+        partition found so far.
+        """
+        if mask == 0:
+            self._new_partition(wins_so_far, 0)
+            return 0, True
+        key, transform = self._canonical(mask)
+        exact, upper, choice = self._memo.get(key, (None, None, None))
+        if exact is not None:
+            if exact > _INFEASIBLE:
+                self._new_partition(wins_so_far + exact, mask)
+            return exact, True
+        target = max(target, self._incumbent + 1 - wins_so_far)
+        if upper is not None and upper < target:
+            return upper, False
+        self._check_time()
+        bound = self._bound(mask)
+        if bound == _INFEASIBLE:
+            self._memo[key] = (bound, bound, None)
+            return bound, True
+        if bound < target:
+            self._memo[key] = (None, bound, None)
+            return bound, False
+        best, best_exact, best_district = _INFEASIBLE, True, None
+        for wins, district in self._candidates(mask):
+            child_target = max(target, best + 1,
+                               self._incumbent + 1 - wins_so_far) - wins
+            self._path.append(district)
+            value, value_exact = self._value(mask & ~district,
+                                             wins_so_far + wins,
+                                             child_target)
+            self._path.pop()
+            if value == _INFEASIBLE:
+                continue
+            value += wins
+            if value > best or \
+               (value == best and value_exact and not best_exact):
+                best, best_exact, best_district = value, value_exact, district
+            if best_exact and best >= bound:
+                break
+        if best_exact:
+            if best_district is not None and transform is not None:
+                best_district = transform(best_district)
+            self._memo[key] = (best, best, best_district)
+        else:
+            self._memo[key] = (None, best if upper is None
+                               else min(upper, best), None)
+        return best, best_exact
+
+    def _check_time(self):
+        if self._time_limit is not None and \
+           time.time() - self._start_time > self._time_limit:
+            raise _TimeLimit()
+
+    def _new_partition(self, wins, rest):
+        """
+        Records the districts on the current path plus
+        the best partition of the tiles rest if that
+        beats the best partition found so far.
+        """
+        if wins > self._incumbent:
+            self._incumbent = wins
+            self._incumbent_partition = list(self._path) + \
+                                        self._reconstruct(rest)
+
+    def _reconstruct(self, mask):
+        """
+        Districts of the best partition of the tiles in
+        mask, whose value is known exactly.
+        """
+        partition = []
+        while mask:
+            key, _ = self._canonical(mask)
+            choice = self._memo[key][2]
+            district = choice if key == mask else \
+                       self._inverse(key, mask, choice)
+            partition.append(district)
+            mask &= ~district
+        return partition
+
+    def _inverse(self, key, mask, choice):
+        for forward, backward in self._symmetries:
+            if forward(mask) == key:
+                return backward(choice)
+        return choice
+
+    def _canonical(self, mask):
+        """
+        The smallest image of mask under the symmetries,
+        and the permutation mapping mask to it (None for
+        the identity).
+        """
+        key, transform = mask, None
+        for forward, _ in self._symmetries:
+            image = forward(mask)
+            if image < key:
+                key, transform = image, forward
+        return key, transform
+
+    def _components(self, mask):
+        components = []
+        while mask:
+            component = frontier = mask & -mask
+            while frontier:
+                grown = 0
+                while frontier:
+                    bit = frontier & -frontier
+                    frontier ^= bit
+                    grown |= self._neighbors[bit.bit_length() - 1]
+                frontier = grown & mask & ~component
+                component |= frontier
+            components.append(component)
+            mask &= ~component
+        return components
+
+    def _bound(self, mask):
+        """
+        Upper bound on the districts won in any partition
+        of mask: each connected piece of mask holds a
+        whole number of districts, and 1 needs
+        _min_one_votes votes in each district it wins.
+        """
+        bound = 0
+        for component in self._components(mask):
+            n_tiles = bin(component).count('1')
+            if n_tiles % self._size != 0:
+                return _INFEASIBLE
+            one_votes = bin(component & self._ones).count('1')
+            bound += min(n_tiles // self._size,
+                         one_votes // self._min_one_votes
+                         if self._min_one_votes > 0 else n_tiles)
+        return bound
+
+    def _candidates(self, mask):
+        """
+        Yields (wins, district) for the connected
+        districts in mask containing its first tile.
+        """
+        for district in self._connected_sets(mask & -mask, mask):
+            yield int(_one_wins(bin(district & self._ones).count('1'),
+                                self._size)), district
+
+    def _connected_sets(self, root, mask):
+        """
+        Every connected set of _size tiles of mask that
+        contains root, each once (by always extending
+        with tiles not yet considered).
+        """
+        neighbors = self._neighbors
+        size = self._size
+
+        def extend(subset, count, extension, seen):
+            if count == size:
+                yield subset
+                return
+            self._check_time()
+            while extension:
+                bit = extension & -extension
+                extension ^= bit
+                new = neighbors[bit.bit_length() - 1] & mask & ~seen
+                for district in extend(subset | bit, count + 1,
+                                       extension | new, seen | new):
+                    yield district
+
+        first = neighbors[root.bit_length() - 1] & mask
+        return extend(root, 1, first, root | first)
+
+    def _district(self, mask):
+        n_cols = self._shape[1]
+        return District(divmod(node, n_cols) for node in range(self._n_tiles)
+                        if mask >> node & 1)
+
+
+def find_optimal_districting(voter_distribution, n_districts,
+                             time_limit = None):
+    """
+    Returns (max_wins, districts, upper_bound) for the
+    partitions of voter_distribution into n_districts
+    contiguous districts of equal size: the most
+    districts won (or tied) by 1, a list of Districts
+    achieving it, and an upper bound on the optimum.
+    max_wins == upper_bound certifies the optimum;
+    otherwise time_limit was reached and the gap is
+    upper_bound - max_wins.
+    """
+    return ExactDistricting(voter_distribution, n_districts,
+                            time_limit).solve()
@@ -6,9 +6,22 @@ import numpy as np
 import cPickle as pickle
 from find_winning_districting import District
 from find_winning_districting import search_configurations
+from exact_districting import find_optimal_districting
 
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--checkpoint', required = False)
+    parser.add_argument('-r', '--resume', required = False,
+                        action = 'store_true')
+    parser.add_argument('-e', '--exact', required = False,
+                        action = 'store_true')
+
+    args = vars(parser.parse_args())
+    if args['resume'] and args['checkpoint'] is None:
+        parser.error("--resume needs a --checkpoint file")
+
     voter_distribution = np.array([[1, 1, 0, 0, 0],
                                    [0, 1, 1, 0, 1],
                                    [1, 0, 0, 0, 0],
@@ -18,10 +31,22 @@ if __name__ == "__main__":
     init_districts = [District([(i, j) for j in range(5)])
                       for i in range(5)]
 
-    max_wins, final_configuration \
-        = search_configurations(voter_distribution,
-                                init_districts,
-                                num_district_wins_stop = 3)
+    if args['exact']:
+        max_wins, districts, upper_bound \
+            = find_optimal_districting(voter_distribution,
+                                       len(init_districts))
+        print "Max districts won in any configuration:", max_wins,
+        print "(proven optimal)" if max_wins == upper_bound else \
+              "(upper bound %d)" % upper_bound
+        for district in districts:
+            print sorted(district.return_tiles())
+    else:
+        max_wins, final_configuration \
+            = search_configurations(voter_distribution,
+                                    init_districts,
+                                    num_district_wins_stop = 3,
+                                    checkpoint_file = args['checkpoint'],
+                                    resume = args['resume'])
 
-    print "Max districts won in any configuration:", max_wins
-    pickle.dump(final_configuration, open('final_config.pkl', 'w'))
+        print "Max districts won in any configuration:", max_wins
+        pickle.dump(final_configuration, open('final_config.pkl', 'w'))
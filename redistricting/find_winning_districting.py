@@ -4,10 +4,16 @@ a given party wins, using Monte Carlo.
 
 http://fivethirtyeight.com/features/rig-the-election-with-math/
 """
+import os
 import random
+import time
 import numpy as np
 import copy
-from itertools import combinations
+from annealing_schedules import GeometricSchedule
+from precinct_graph import PrecinctGraph
+from precinct_graph import grid_graph
+from search_metrics import MetricsTracker
+from search_metrics import print_progress
 
 class District:
     """
@@ -18,9 +24,19 @@ class District:
     the is_contiguous and get_contiguous_subdistricts
     methods, but such a District does not have well
     defined behavior under the other methods.)
+
+    Tiles are (i, j) pairs of a grid with 4-neighbor
+    adjacency, unless graph (a PrecinctGraph) is
+    given, in which case adjacency is looked up in
+    the graph.
     """
-    def __init__(self, tiles):
+    def __init__(self, tiles, graph = None):
         self._tiles = set(tiles)
+        self._graph = graph
+
+    def __deepcopy__(self, memo):
+        # The graph describes the board and is shared by copies.
+        return District(copy.deepcopy(self._tiles, memo), self._graph)
 
     def __contains__(self, tile):
         return tile in self._tiles
@@ -60,7 +76,7 @@ class District:
         if len(self) == 0:
             return []
         if len(self) == 1:
-            return [District(self._tiles)]
+            return [District(self._tiles, self._graph)]
         
         subdistricts = []
         collected = set()
@@ -76,7 +92,7 @@ class District:
                 remaining.difference_update(new_tiles)
                 queue = new_tiles
 
-            subdistricts.append(District(collected))
+            subdistricts.append(District(collected, self._graph))
 
             if len(remaining) == 0: break
             
@@ -114,8 +130,10 @@ class District:
         """
         trades = []
         for trade_tile_other in other_district.find_border(self):
-            new_district_this = District(self._tiles | {trade_tile_other})
-            new_district_other = District(other_district._tiles - {trade_tile_other})
+            new_district_this = District(self._tiles | {trade_tile_other},
+                                         self._graph)
+            new_district_other = District(other_district._tiles - {trade_tile_other},
+                                          self._graph)
             other_subdistricts = new_district_other.get_contiguous_subdistricts()
             sub_borders = [new_district_this.find_border(subdistrict)
                            for subdistrict in other_subdistricts]
@@ -123,7 +141,8 @@ class District:
                                                sub_borders) - {trade_tile_other}
             for trade_tile_this in possible_trade_tiles_this:
                 new_new_district_this = District(new_district_this._tiles - \
-                                                 {trade_tile_this})
+                                                 {trade_tile_this},
+                                                 self._graph)
                 if new_new_district_this.is_contiguous():
                     trades.append((trade_tile_this, trade_tile_other))
         return trades
@@ -133,6 +152,8 @@ class District:
         Returns True if tile has any neighbors
         in tile_set.
         """
+        if self._graph is not None:
+            return len(self._get_neighbors(tile, tile_set)) > 0
         i, j = tile
         for delta in [-1, 1]:
             if (i + delta, j) in tile_set:
@@ -142,6 +163,11 @@ class District:
         return False
 
     def _get_neighbors(self, tile, tile_set):
+        if self._graph is not None:
+            graph = self._graph
+            return [graph.tile(node) for node
+                    in graph.neighbors(graph.node(tile)).tolist()
+                    if graph.tile(node) in tile_set]
         neighbors = []
         i, j = tile
         for delta in [-1, 1]:
@@ -151,6 +177,245 @@ class District:
                 neighbors.append((i, j + delta))
         return neighbors
 
+class _NeighborLists:
+    """
+    Neighbors of each node of a CSR adjacency
+    (indptr, indices), read from the arrays on each
+    lookup rather than copied into Python lists.
+    """
+    def __init__(self, indptr, indices):
+        self._indptr = indptr
+        self._indices = indices
+
+    def __len__(self):
+        return len(self._indptr) - 1
+
+    def __getitem__(self, node):
+        return self._indices[self._indptr.item(node):
+                             self._indptr.item(node + 1)].tolist()
+
+class _CutVertexIndex:
+    """
+    Depth-first search structure of a contiguous set
+    of nodes, used to tell how the set splits when a
+    single node is removed.  Removing node v leaves
+    one component for each DFS child c of v with
+    low[c] >= disc[v] (the subtree of c), plus, unless
+    v is the root, one component holding everything
+    else.  v is an articulation point if that makes
+    more than one component.
+    """
+    def __init__(self, members, neighbors):
+        self._disc = {}
+        self._finish = {}
+        self._separating = {}
+        root = next(iter(members))
+        low = {}
+        counter = 0
+        self._disc[root] = low[root] = counter
+        stack = [(root, None, iter(neighbors[root]))]
+        children = {root : []}
+        while stack:
+            node, parent, neighbor_iter = stack[-1]
+            advanced = False
+            for neighbor in neighbor_iter:
+                if neighbor not in members or neighbor == parent:
+                    continue
+                if neighbor in self._disc:
+                    low[node] = min(low[node], self._disc[neighbor])
+                    continue
+                counter += 1
+                self._disc[neighbor] = low[neighbor] = counter
+                children[node].append(neighbor)
+                children[neighbor] = []
+                stack.append((neighbor, node, iter(neighbors[neighbor])))
+                advanced = True
+                break
+            if advanced:
+                continue
+            stack.pop()
+            self._finish[node] = counter
+            if parent is not None:
+                low[parent] = min(low[parent], low[node])
+
+        self._root = root
+        for node, node_children in children.iteritems():
+            separating = [child for child in node_children
+                          if low[child] >= self._disc[node]]
+            self._separating[node] = sorted(separating,
+                                            key = self._disc.get)
+
+    def num_components_without(self, node):
+        return len(self._separating[node]) + int(node != self._root)
+
+    def component_without(self, node, other):
+        """
+        Label of the component containing other once
+        node is removed (-1 for the component holding
+        the root side).
+        """
+        disc = self._disc[other]
+        for idx, child in enumerate(self._separating[node]):
+            if self._disc[child] <= disc <= self._finish[child]:
+                return idx
+        return -1
+
+
+class _TradeIndex:
+    """
+    The possible trades, held in a list for uniform
+    sampling (random.choice works on it directly),
+    with the position of each trade and the trades
+    of each pair of districts indexed so that all
+    trades of a pair are removed in O(1) each.
+    """
+    def __init__(self):
+        self._trades = []
+        self._position = {}
+        self._pair_trades = {}
+        self._district_pairs = {}
+
+    def __len__(self):
+        return len(self._trades)
+
+    def __getitem__(self, position):
+        return self._trades[position]
+
+    def __iter__(self):
+        return iter(self._trades)
+
+    def add(self, pair, trade):
+        item = (pair, trade)
+        self._position[item] = len(self._trades)
+        self._trades.append(item)
+        self._pair_trades.setdefault(pair, []).append(item)
+        for idx in pair:
+            self._district_pairs.setdefault(idx, set()).add(pair)
+
+    def remove_district(self, idx):
+        """
+        Removes the trades of all pairs involving
+        district idx.
+        """
+        for pair in list(self._district_pairs.get(idx, ())):
+            self.remove_pair(pair)
+
+    def remove_pair(self, pair):
+        for idx in pair:
+            self._district_pairs.get(idx, set()).discard(pair)
+        for item in self._pair_trades.pop(pair, ()):
+            self._remove(self._position.pop(item))
+
+    def _remove(self, position):
+        last = self._trades.pop()
+        if position < len(self._trades):
+            self._trades[position] = last
+            self._position[last] = position
+
+
+class _SumTree:
+    """
+    Binary tree of partial sums over a growable list
+    of non-negative weights, stored in a flat list.
+    Setting a weight and drawing a position with
+    probability proportional to its weight are both
+    O(log n).
+    """
+    def __init__(self):
+        self._capacity = 1
+        self._tree = [0., 0.]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, position):
+        return self._tree[self._capacity + position]
+
+    def __setitem__(self, position, weight):
+        node = self._capacity + position
+        self._tree[node] = weight
+        while node > 1:
+            node //= 2
+            self._tree[node] = self._tree[2 * node] + self._tree[2 * node + 1]
+
+    def append(self, weight):
+        if self._size == self._capacity:
+            leaves = self._tree[self._capacity:]
+            self._capacity *= 2
+            self._tree = [0.] * (2 * self._capacity)
+            self._tree[self._capacity:self._capacity + len(leaves)] = leaves
+            for node in range(self._capacity - 1, 0, -1):
+                self._tree[node] = self._tree[2 * node] + \
+                                   self._tree[2 * node + 1]
+        self._size += 1
+        self[self._size - 1] = weight
+
+    def pop(self):
+        weight = self[self._size - 1]
+        self[self._size - 1] = 0.
+        self._size -= 1
+        return weight
+
+    def total(self):
+        return self._tree[1]
+
+    def find(self, value):
+        """
+        Returns the position where the running sum of
+        the weights first exceeds value.
+        """
+        node = 1
+        while node < self._capacity:
+            left = 2 * node
+            if value < self._tree[left]:
+                node = left
+            else:
+                value -= self._tree[left]
+                node = left + 1
+        return min(node - self._capacity, self._size - 1)
+
+
+class _WeightedTradeIndex(_TradeIndex):
+    """
+    _TradeIndex that also keeps a weight (the
+    acceptance probability) for each trade in a sum
+    tree, to draw trades in proportion to it.
+    """
+    def __init__(self):
+        _TradeIndex.__init__(self)
+        self._weights = _SumTree()
+
+    def add(self, pair, trade, weight = 1.):
+        _TradeIndex.add(self, pair, trade)
+        self._weights.append(weight)
+
+    def set_weights(self, weights):
+        for position, weight in enumerate(weights):
+            self._weights[position] = weight
+
+    def total_weight(self):
+        return self._weights.total()
+
+    def weighted_choice(self, rng):
+        return self._trades[self._weights.find(rng.random() *
+                                               self._weights.total())]
+
+    def _remove(self, position):
+        last_weight = self._weights.pop()
+        if position < len(self._weights):
+            self._weights[position] = last_weight
+        _TradeIndex._remove(self, position)
+
+
+def _one_wins(one_votes, size):
+    """
+    Whether 1 wins or ties a district of the given
+    size (population) with the given number of votes
+    for 1.
+    """
+    return 2 * one_votes >= size
+
 class BaseConfiguration:
     """
     Base class for a set of districts and
@@ -158,16 +423,93 @@ class BaseConfiguration:
     classes should inherit from this and
     implement the _get_trade_probability
     method.
+
+    voter_distribution is either a grid of votes for
+    1, one voter per tile, or a PrecinctGraph.
+    Tiles are stored as node numbers (tile (i, j) of
+    a grid is node i * n_cols + j), and the districts
+    as a single array of district labels, one per
+    node, together with the set of nodes of each
+    district.  A trade updates both in place.
+
+    The size of a district is its population.  If
+    population_tolerance is given, a trade may also
+    move a single border node to the neighboring
+    district (a trade with None for the node given in
+    return), as long as the district losing it stays
+    contiguous, so that district populations can
+    change.  Only trades that keep the population of
+    both districts within that fraction of the mean
+    district population, or bring it closer to the
+    mean, are then possible.
+
+    If rejection_free is True, iterate never rejects:
+    the acceptance probabilities of all possible
+    trades are kept in a sum tree, an accepted trade
+    is drawn directly in proportion to them, and the
+    number of ordinary iterations that would have
+    passed until that acceptance is added to
+    elapsed_iterations.  Subclasses whose trade
+    probabilities depend on more than the two
+    districts involved must set
+    _local_trade_probabilities to False, so that all
+    weights are recomputed before every draw.
     """
-    def __init__(self, districts, voter_distribution):
+    _local_trade_probabilities = True
+
+    # Attributes describing the board, which never change
+    # and are shared between copies of a configuration.
+    _shared_attributes = ['_voter_distribution', '_graph', '_votes',
+                          '_population', '_indptr', '_indices', '_neighbors']
+
+    def __init__(self, districts, voter_distribution,
+                 rejection_free = False, population_tolerance = None):
+        self._rejection_free = rejection_free
+        self._elapsed_iterations = 0
+        self._accepted_trades = 0
+        self._timings = None
+        self._rng = None
         self._voter_distribution = voter_distribution
-        self._districts = districts
+        if isinstance(voter_distribution, PrecinctGraph):
+            self._graph = voter_distribution
+        else:
+            self._graph = grid_graph(voter_distribution)
+        self._shape = self._graph.shape
+        # The arrays of the graph are used as they are (possibly
+        # memory mapped), and indexed one node at a time.
+        self._votes = np.asarray(self._graph.votes())
+        self._population = np.asarray(self._graph.population())
+        self._indptr, self._indices = self._graph.adjacency()
+        self._neighbors = _NeighborLists(self._indptr, self._indices)
+
+        self._labels = np.full(len(self._votes), -1, dtype = np.int32)
+        self._members = []
+        for idx, district in enumerate(districts):
+            nodes = {self._node(tile) for tile in district.return_tiles()}
+            assert np.all(self._labels[list(nodes)] == -1)
+            self._labels[list(nodes)] = idx
+            self._members.append(nodes)
 
         self._validate_districts()
+        self._compute_tallies()
+        self._population_bounds = None
+        if population_tolerance is not None:
+            mean_population = float(self._population.sum()) / len(self)
+            self._population_bounds = (
+                mean_population * (1. - population_tolerance),
+                mean_population * (1. + population_tolerance))
+        self._cut_indexes = [None] * len(self)
         self._compute_possible_trades()
 
     def __len__(self):
-        return len(self._districts)
+        return len(self._members)
+
+    def __deepcopy__(self, memo):
+        new_configuration = copy.copy(self)
+        for name, value in self.__dict__.iteritems():
+            if name not in self._shared_attributes:
+                setattr(new_configuration, name, copy.deepcopy(value, memo))
+        return new_configuration
 
     def iterate(self):
         """
@@ -176,76 +518,519 @@ class BaseConfiguration:
         given by the _get_trade_probability
         method.
         """
-        trade = random.choice(self._possible_trades)
+        if self._rejection_free:
+            self._iterate_rejection_free()
+            return
+        self._elapsed_iterations += 1
+        rng = self._random()
+        trade = rng.choice(self._possible_trades)
         (idx1, idx2), (tile1, tile2) = trade
-        prob = self._get_trade_probability(idx1, tile1,
-                                           idx2, tile2)
-        if random.random() <= prob:
+        prob = self._timed('evaluation', self._get_trade_probability,
+                           idx1, tile1, idx2, tile2)
+        if rng.random() <= prob:
             self._make_trade(idx1, tile1, idx2, tile2)
 
+    def set_rng(self, rng):
+        """
+        Use rng (a random.Random) instead of the global
+        random module for this configuration.
+        """
+        self._rng = rng
+
+    def elapsed_iterations(self):
+        """
+        Number of ordinary (rejecting) iterations that
+        the iterations so far are equivalent to.
+        """
+        return self._elapsed_iterations
+
+    def accepted_trades(self):
+        return self._accepted_trades
+
+    def num_possible_trades(self):
+        return len(self._possible_trades)
+
+    def enable_timing(self):
+        """
+        Start accumulating the time spent evaluating
+        trade probabilities and updating the possible
+        trades, as returned by timings.
+        """
+        if self._timings is None:
+            self._timings = {'evaluation' : 0., 'enumeration' : 0.}
+
+    def timings(self):
+        """
+        Seconds spent in trade probability evaluation
+        and in trade enumeration since enable_timing
+        was called.  In rejection free mode the
+        probabilities of new trades are computed as part
+        of the enumeration.
+        """
+        if self._timings is None:
+            return {'evaluation' : 0., 'enumeration' : 0.}
+        return dict(self._timings)
+
+    def _timed(self, name, function, *args):
+        if self._timings is None:
+            return function(*args)
+        start = time.time()
+        result = function(*args)
+        self._timings[name] += time.time() - start
+        return result
+
+    def _iterate_rejection_free(self, max_iterations = None):
+        """
+        Draws the number of ordinary iterations up to and
+        including the next accepted trade, and makes that
+        trade.  If there would be more than max_iterations,
+        only max_iterations rejected iterations are
+        counted and no trade is made.  Returns the number
+        of iterations counted.
+        """
+        trades = self._possible_trades
+        rng = self._random()
+        if not self._local_trade_probabilities:
+            self._timed('evaluation', self._refresh_trade_weights)
+        accept_prob = trades.total_weight() / len(trades)
+        if accept_prob <= 0.:
+            raise RuntimeError("no possible trade has a nonzero probability")
+        # Number of uniform proposals up to the first acceptance.
+        if accept_prob >= 1.:
+            n_iterations = 1
+        else:
+            n_iterations = 1 + int(
+                np.log(1. - rng.random()) / np.log(1. - accept_prob))
+        if max_iterations is not None and n_iterations > max_iterations:
+            self._elapsed_iterations += max_iterations
+            return max_iterations
+        self._elapsed_iterations += n_iterations
+        (idx1, idx2), (tile1, tile2) = trades.weighted_choice(rng)
+        self._make_trade(idx1, tile1, idx2, tile2)
+        return n_iterations
+
+    def _refresh_trade_weights(self):
+        """
+        Recompute the weights of all possible trades in
+        rejection free mode, e.g. after a parameter of
+        the trade probabilities has changed.
+        """
+        if self._rejection_free:
+            self._possible_trades.set_weights(
+                self._get_trade_probabilities(list(self._possible_trades)))
+
+    def _random(self):
+        if self._rng is None:
+            return random
+        return self._rng
+
+    def _get_trade_probabilities(self, trades):
+        """
+        Acceptance probabilities of a list of trades
+        ((idx1, idx2), (tile1, tile2)).  Subclasses may
+        override this with a vectorized version.
+        """
+        return [self._get_trade_probability(idx1, tile1, idx2, tile2)
+                for (idx1, idx2), (tile1, tile2) in trades]
+
     def num_districts_one_win_or_tie(self):
-        return sum(self._num_one_votes(district.return_tiles()) >= \
-                   int(np.ceil(len(district) / 2.))
-                   for district in self._districts)
+        return self._num_wins
+
+    def get_districts(self):
+        """
+        Returns the current districts as a list
+        of District objects.
+        """
+        graph = self._voter_distribution \
+                if isinstance(self._voter_distribution, PrecinctGraph) \
+                else None
+        return [District((self._tile(node) for node in nodes), graph)
+                for nodes in self._members]
+
+    def get_labels(self):
+        """
+        Returns an array of the shape of the voter
+        distribution giving the district of each tile.
+        """
+        return self._labels.reshape(self._shape).copy()
+
+    def get_search_state(self):
+        """
+        State of the configuration, besides its districts
+        and random number generator, that a checkpoint
+        must keep to continue the chain, as a list of
+        numbers.
+        """
+        return []
+
+    def set_search_state(self, state):
+        pass
+
+    def _node(self, tile):
+        return self._graph.node(tile)
+
+    def _tile(self, node):
+        return self._graph.tile(node)
+
+    def _compute_tallies(self):
+        """
+        Per district number of votes for 1, population
+        and whether 1 wins (or ties), plus the number of
+        districts 1 wins.  Trades update these in place.
+        """
+        self._one_votes = np.bincount(self._labels, weights = self._votes,
+                                      minlength = len(self)).tolist()
+        self._sizes = np.bincount(self._labels, weights = self._population,
+                                  minlength = len(self)) \
+                        .astype(self._population.dtype).tolist()
+        self._wins = [_one_wins(one_votes, size) for one_votes, size
+                      in zip(self._one_votes, self._sizes)]
+        self._num_wins = sum(self._wins)
+
+    def _trade_change(self, tile1, tile2):
+        """
+        Change in the votes for 1 and in the population
+        of the district that gives tile1 and gets tile2,
+        either of which may be None for a move.
+        """
+        vote_change, size_change = 0, 0
+        if tile2 is not None:
+            vote_change += self._votes.item(tile2)
+            size_change += self._population.item(tile2)
+        if tile1 is not None:
+            vote_change -= self._votes.item(tile1)
+            size_change -= self._population.item(tile1)
+        return vote_change, size_change
+
+    def _trade_changes(self, trades):
+        """
+        Vectorized _trade_change for a list of trades
+        ((idx1, idx2), (tile1, tile2)), returned as the
+        arrays idx1, idx2, vote_change, size_change.
+        """
+        idx1, idx2, tile1, tile2 = np.array(
+            [pair + tuple(-1 if tile is None else tile for tile in trade)
+             for pair, trade in trades], dtype = int).reshape(-1, 4).T
+        changes = []
+        for values in [self._votes, self._population]:
+            changes.append(np.where(tile2 >= 0, values[tile2], 0) -
+                           np.where(tile1 >= 0, values[tile1], 0))
+        return idx1, idx2, changes[0], changes[1]
+
+    def _trade_win_change(self, idx1, tile1, idx2, tile2):
+        """
+        Change in the number of districts won by 1 if
+        tile1 of district idx1 were traded for tile2 of
+        district idx2.
+        """
+        vote_change, size_change = self._trade_change(tile1, tile2)
+        return int(_one_wins(self._one_votes[idx1] + vote_change,
+                             self._sizes[idx1] + size_change)) + \
+               int(_one_wins(self._one_votes[idx2] - vote_change,
+                             self._sizes[idx2] - size_change)) - \
+               int(self._wins[idx1]) - int(self._wins[idx2])
+
+    def _trade_win_changes(self, trades):
+        """
+        Vectorized _trade_win_change for a list of
+        trades ((idx1, idx2), (tile1, tile2)).
+        """
+        idx1, idx2, vote_change, size_change = self._trade_changes(trades)
+        one_votes = np.array(self._one_votes)
+        sizes = np.array(self._sizes)
+        wins = np.array(self._wins, dtype = int)
+        return _one_wins(one_votes[idx1] + vote_change,
+                         sizes[idx1] + size_change).astype(int) + \
+               _one_wins(one_votes[idx2] - vote_change,
+                         sizes[idx2] - size_change).astype(int) - \
+               wins[idx1] - wins[idx2]
 
     def _validate_districts(self):
-        for district in self._districts:
-            assert district.is_contiguous()
-        
-        for district1, district2 in combinations(self._districts, 2):
-            assert len(district1.return_tiles() & district2.return_tiles()) == 0
+        assert np.all(self._labels >= 0)
+        for idx in range(len(self)):
+            assert len(self._component(idx, next(iter(self._members[idx])))) \
+                == len(self._members[idx])
+
+    def _component(self, idx, start, add = None, remove = None):
+        """
+        Returns the nodes connected to start within
+        district idx, where the node add is counted
+        as part of the district and the node remove
+        is not.
+        """
+        members = self._members[idx]
+        collected = {start}
+        queue = [start]
+        while queue:
+            node = queue.pop()
+            for neighbor in self._neighbors[node]:
+                if neighbor in collected or neighbor == remove:
+                    continue
+                if neighbor in members or neighbor == add:
+                    collected.add(neighbor)
+                    queue.append(neighbor)
+        return collected
+
+    def _border(self, idx, other_idx):
+        """
+        Returns the nodes of district idx that are
+        adjacent to district other_idx.
+        """
+        other = self._members[other_idx]
+        return [node for node in self._members[idx]
+                if any(neighbor in other
+                       for neighbor in self._neighbors[node])]
+
+    def _cut_index(self, idx):
+        if self._cut_indexes[idx] is None:
+            self._cut_indexes[idx] = _CutVertexIndex(self._members[idx],
+                                                     self._neighbors)
+        return self._cut_indexes[idx]
+
+    def _joins_all_components(self, idx, removed, touching):
+        """
+        Whether district idx stays contiguous when the
+        node removed is replaced by a node whose
+        neighbors in district idx are touching, i.e.
+        whether that node is adjacent to every
+        component left after removing removed.
+        """
+        cut_index = self._cut_index(idx)
+        n_components = cut_index.num_components_without(removed)
+        if n_components == 0:
+            return True
+        touched = {cut_index.component_without(removed, neighbor)
+                   for neighbor in touching if neighbor != removed}
+        return len(touched) == n_components
+
+    def _find_allowed_trades(self, idx1, idx2):
+        """
+        Returns the trades (tile1, tile2) of a node of
+        district idx1 for a node of district idx2 such
+        that both districts remain contiguous, using
+        the cached articulation point structure of
+        each district instead of searching the new
+        districts.  Removing a node that is not an
+        articulation point leaves one component, which
+        the added node joins unless the removed node was
+        its only neighbor in the district, so only
+        articulation points need the full check.
+
+        A node that takes the place of an articulation
+        point must touch each of the two or more
+        components it leaves, so only nodes with at
+        least two neighbors in that district are
+        candidates for it, and the rest of the border is
+        not scanned.
+        """
+        border1 = self._border(idx1, idx2)
+        border2 = self._border(idx2, idx1)
+        members1, members2 = self._members[idx1], self._members[idx2]
+        touching1 = {tile2 : [node for node in self._neighbors[tile2]
+                              if node in members1] for tile2 in border2}
+        touching2 = {tile1 : [node for node in self._neighbors[tile1]
+                              if node in members2] for tile1 in border1}
+        cut_index1, cut_index2 = self._cut_index(idx1), self._cut_index(idx2)
+        simple1 = {tile1 : cut_index1.num_components_without(tile1) == 1
+                   for tile1 in border1}
+        # Candidates for a tile2 that is not an articulation point
+        # and touches district idx1 once, so cannot replace one.
+        non_cut1 = [tile1 for tile1 in border1
+                    if cut_index1.num_components_without(tile1) < 2]
+        # Candidates for a tile2 that is an articulation point.
+        multi1 = [tile1 for tile1 in border1 if len(touching2[tile1]) >= 2]
+        check_balance = self._population_bounds is not None
+
+        trades = []
+        for tile2 in border2:
+            n_components2 = cut_index2.num_components_without(tile2)
+            simple2 = n_components2 == 1
+            if n_components2 >= 2:
+                candidates = multi1
+            elif len(touching1[tile2]) >= 2:
+                candidates = border1
+            else:
+                candidates = non_cut1
+            for tile1 in candidates:
+                if check_balance and \
+                   not self._keeps_balance(idx1, tile1, idx2, tile2):
+                    continue
+                if simple2:
+                    if touching2[tile1] == [tile2]:
+                        continue
+                elif not self._joins_all_components(idx2, tile2,
+                                                    touching2[tile1]):
+                    continue
+                if simple1[tile1]:
+                    if touching1[tile2] == [tile1]:
+                        continue
+                elif not self._joins_all_components(idx1, tile1,
+                                                    touching1[tile2]):
+                    continue
+                trades.append((tile1, tile2))
+
+        if check_balance:
+            trades.extend(self._find_allowed_moves(idx1, idx2, border1))
+        return trades
+
+    def _find_allowed_moves(self, idx1, idx2, border1):
+        """
+        Returns the moves (tile1, None) of a node of
+        district idx1 to district idx2, and the moves
+        (None, tile2) in the other direction, that are
+        allowed by the population tolerance.  The node
+        is on the border, so the district getting it
+        stays contiguous, and the district losing it
+        must keep one component without it.
+        """
+        moves = []
+        cut_index1 = self._cut_index(idx1)
+        for tile1 in border1:
+            if cut_index1.num_components_without(tile1) == 1 and \
+               self._keeps_balance(idx1, tile1, idx2, None):
+                moves.append((tile1, None))
+        cut_index2 = self._cut_index(idx2)
+        for tile2 in self._border(idx2, idx1):
+            if cut_index2.num_components_without(tile2) == 1 and \
+               self._keeps_balance(idx1, None, idx2, tile2):
+                moves.append((None, tile2))
+        return moves
 
-        all_tiles = reduce(lambda x, y : x | y,
-                           [district.return_tiles()
-                            for district in self._districts]
-                           )
-        assert all_tiles == {(i, j)
-                             for i in range(self._voter_distribution.shape[0])
-                             for j in range(self._voter_distribution.shape[1])}
+    def _keeps_balance(self, idx1, tile1, idx2, tile2):
+        """
+        Whether trading tile1 of district idx1 for tile2
+        of district idx2 (either may be None for a move)
+        is allowed by the population tolerance.
+        """
+        if self._population_bounds is None:
+            return True
+        _, size_change = self._trade_change(tile1, tile2)
+        if size_change == 0:
+            return True
+        low, high = self._population_bounds
+        mean = (low + high) / 2.
+        for size, new_size in [
+                (self._sizes[idx1], self._sizes[idx1] + size_change),
+                (self._sizes[idx2], self._sizes[idx2] - size_change)]:
+            if not low <= new_size <= high and \
+               abs(new_size - mean) > abs(size - mean):
+                return False
+        return True
+
+    def _compute_adjacency(self):
+        """
+        District adjacency graph: self._adjacency[idx1][idx2]
+        is the number of pairs of neighboring nodes in
+        districts idx1 and idx2.
+        """
+        self._adjacency = [{} for _ in range(len(self))]
+        heads = np.repeat(self._labels, np.diff(self._indptr))
+        tails = self._labels[self._indices]
+        cut = heads != tails
+        pairs, counts = np.unique(heads[cut].astype(np.int64) * len(self) +
+                                  tails[cut], return_counts = True)
+        for pair, count in zip(pairs.tolist(), counts.tolist()):
+            idx1, idx2 = divmod(pair, len(self))
+            self._adjacency[idx1][idx2] = count
+
+    def _move_adjacency(self, node, old_idx, new_idx):
+        """
+        Update the adjacency graph for node moving from
+        district old_idx to new_idx.  Must be called
+        before the label of node is changed.
+        """
+        for neighbor in self._neighbors[node]:
+            idx = self._labels.item(neighbor)
+            if idx != old_idx:
+                self._add_adjacency(old_idx, idx, -1)
+            if idx != new_idx:
+                self._add_adjacency(new_idx, idx, 1)
+
+    def _add_adjacency(self, idx1, idx2, count):
+        for a, b in [(idx1, idx2), (idx2, idx1)]:
+            counts = self._adjacency[a]
+            counts[b] = counts.get(b, 0) + count
+            if counts[b] == 0:
+                del counts[b]
 
     def _compute_possible_trades(self):
-        self._possible_trades = []
-        for (idx1, district1), (idx2, district2) \
-            in combinations(enumerate(self._districts), 2):
-            for trade in district1.find_allowed_trades(district2):
-                self._possible_trades.append(((idx1, idx2),
-                                              trade)
-                                             )
+        self._compute_adjacency()
+        if self._rejection_free:
+            self._possible_trades = _WeightedTradeIndex()
+        else:
+            self._possible_trades = _TradeIndex()
+        for idx1 in range(len(self)):
+            for idx2 in self._adjacency[idx1]:
+                if idx1 < idx2:
+                    self._add_pair_trades(idx1, idx2)
+
+    def _add_pair_trades(self, idx1, idx2):
+        trades = self._find_allowed_trades(idx1, idx2)
+        if not self._rejection_free:
+            for trade in trades:
+                self._possible_trades.add((idx1, idx2), trade)
+            return
+        weights = self._get_trade_probabilities(
+            [((idx1, idx2), trade) for trade in trades])
+        for trade, weight in zip(trades, weights):
+            self._possible_trades.add((idx1, idx2), trade, weight)
 
     def _make_trade(self, idx_dist1, tile_dist1, idx_dist2, tile_dist2):
-        new_dist1 = District((self._districts[idx_dist1].return_tiles() - \
-                              {tile_dist1}) | {tile_dist2})
-        new_dist2 = District((self._districts[idx_dist2].return_tiles() - \
-                              {tile_dist2}) | {tile_dist1})
-        self._districts[idx_dist1] = new_dist1
-        self._districts[idx_dist2] = new_dist2
+        """
+        Moves tile_dist1 to district idx_dist2 and
+        tile_dist2 to district idx_dist1.  For a move,
+        one of the two is None.
+        """
+        self._accepted_trades += 1
+        members1, members2 = self._members[idx_dist1], self._members[idx_dist2]
+        if tile_dist1 is not None:
+            self._move_adjacency(tile_dist1, idx_dist1, idx_dist2)
+            self._labels[tile_dist1] = idx_dist2
+        if tile_dist2 is not None:
+            self._move_adjacency(tile_dist2, idx_dist2, idx_dist1)
+            self._labels[tile_dist2] = idx_dist1
+        if tile_dist1 is not None:
+            members1.remove(tile_dist1)
+        if tile_dist2 is not None:
+            members1.add(tile_dist2)
+            members2.remove(tile_dist2)
+        if tile_dist1 is not None:
+            members2.add(tile_dist1)
+
+        vote_change, population_change = self._trade_change(tile_dist1,
+                                                            tile_dist2)
+        for idx, change, size_change in [
+                (idx_dist1, vote_change, population_change),
+                (idx_dist2, -vote_change, -population_change)]:
+            self._one_votes[idx] += change
+            self._sizes[idx] += size_change
+            wins = _one_wins(self._one_votes[idx], self._sizes[idx])
+            self._num_wins += int(wins) - int(self._wins[idx])
+            self._wins[idx] = wins
+        self._cut_indexes[idx_dist1] = None
+        self._cut_indexes[idx_dist2] = None
 
-        self._update_possible_trades([idx_dist1, idx_dist2])
+        self._timed('enumeration', self._update_possible_trades,
+                    [idx_dist1, idx_dist2])
 
     def _update_possible_trades(self, idx_dist_list):
         """
         Update the possible trades given that only the
         districts with index in idx_dist_list have been
         updated.  (The index is with respect to the
-        list self._districts.)
+        list of districts.)  Only the trades of pairs
+        involving an updated district are removed, and
+        only pairs of an updated district and a district
+        adjacent to it are recomputed.
         """
         idx_updated = set(idx_dist_list)
-        self._possible_trades = [((idx1, idx2), trade)
-                                 for (idx1, idx2), trade
-                                 in self._possible_trades
-                                 if idx1 not in idx_updated and \
-                                 idx2 not in idx_updated]
-        for (idx1, district1), (idx2, district2) \
-            in combinations(enumerate(self._districts), 2):
-            if idx1 not in idx_updated and idx2 not in idx_updated: continue
-            for trade in district1.find_allowed_trades(district2):
-                self._possible_trades.append(((idx1, idx2),
-                                              trade)
-                                             )
-
-    def _num_one_votes(self, tiles):
-        return sum(self._voter_distribution[tile]
-                   for tile in tiles)
+        for idx in idx_updated:
+            self._possible_trades.remove_district(idx)
+        pairs = {(min(idx1, idx2), max(idx1, idx2))
+                 for idx1 in idx_updated
+                 for idx2 in self._adjacency[idx1]}
+        for idx1, idx2 in sorted(pairs):
+            self._add_pair_trades(idx1, idx2)
 
 class ClassicConfiguration(BaseConfiguration):
     """
@@ -253,11 +1038,14 @@ class ClassicConfiguration(BaseConfiguration):
     classic MCMC.
     """
     def __init__(self, districts, voter_distribution,
-                 lower_prob = 0.1):
-        BaseConfiguration.__init__(self, districts,
-                                  voter_distribution)
+                 lower_prob = 0.1, rejection_free = False,
+                 population_tolerance = None):
         self._lower_prob = lower_prob
-    
+        BaseConfiguration.__init__(self, districts,
+                                  voter_distribution,
+                                  rejection_free,
+                                  population_tolerance)
+
     def _get_trade_probability(self, idx1, tile1,
                                idx2, tile2):
         """
@@ -267,53 +1055,313 @@ class ClassicConfiguration(BaseConfiguration):
         where 1 wins decreases then the probability
         of the trade is self._lower_prob.
         """
-        dist1_tiles = self._districts[idx1].return_tiles()
-        dist2_tiles = self._districts[idx2].return_tiles()
+        if self._trade_win_change(idx1, tile1, idx2, tile2) < 0:
+            return self._lower_prob
+        else:
+            return 1.
 
-        new_dist1_tiles = (dist1_tiles - {tile1}) | {tile2}
-        new_dist2_tiles = (dist2_tiles - {tile2}) | {tile1}
+    def set_lower_prob(self, lower_prob):
+        self._lower_prob = lower_prob
+        self._refresh_trade_weights()
 
-        wins_before = int(self._num_one_votes(dist1_tiles) >= \
-                       int(np.ceil(len(dist1_tiles) / 2.))) + \
-            int(self._num_one_votes(dist2_tiles) >= \
-             int(np.ceil(len(dist2_tiles) / 2.)))
-        wins_after = int(self._num_one_votes(new_dist1_tiles) >= \
-                      int(np.ceil(len(new_dist1_tiles) / 2.))) + \
-            int(self._num_one_votes(new_dist2_tiles) >= \
-             int(np.ceil(len(new_dist2_tiles) / 2.)))
+    def _get_trade_probabilities(self, trades):
+        if len(trades) == 0:
+            return []
+        return np.where(self._trade_win_changes(trades) < 0,
+                        self._lower_prob, 1.).tolist()
 
-        if wins_after < wins_before:
-            return self._lower_prob
+class AnnealingConfiguration(BaseConfiguration):
+    """
+    Simulated annealing on the energy
+
+        E = -(number of districts won by 1)
+            - margin_weight * sum over districts lost by 1
+              of (1 - needed / threshold) ** 2
+
+    where a district of size (population) n has
+    threshold n / 2 and needs needed more votes for 1
+    to win it.  The margin term rewards moving votes for
+    1 into the lost districts that are closest to
+    flipping, which gives the chain a direction when
+    no single trade changes the number of wins.  A
+    trade is accepted with probability
+    min(1, exp(-dE / T)), where the temperature T
+    comes from a copy of schedule (see
+    annealing_schedules), by default a
+    GeometricSchedule.
+
+    In rejection free mode the schedule is advanced by
+    all the iterations a draw stands for, and a draw
+    never covers more iterations than the schedule's
+    max_skip, so the temperature only changes between
+    draws.
+    """
+    # The temperature changes after every iteration.
+    _local_trade_probabilities = False
+
+    def __init__(self, districts, voter_distribution,
+                 schedule = None, margin_weight = 1.,
+                 rejection_free = False, population_tolerance = None):
+        if schedule is None:
+            schedule = GeometricSchedule()
+        self._schedule = copy.deepcopy(schedule)
+        self._margin_weight = margin_weight
+        BaseConfiguration.__init__(self, districts,
+                                  voter_distribution,
+                                  rejection_free,
+                                  population_tolerance)
+
+    def iterate(self):
+        accepted_trades = self._accepted_trades
+        if self._rejection_free:
+            n_iterations = self._iterate_rejection_free(
+                self._schedule.max_skip())
         else:
+            BaseConfiguration.iterate(self)
+            n_iterations = 1
+        self._schedule.update(self._accepted_trades > accepted_trades,
+                              self.energy(), n_iterations - 1)
+
+    def energy(self):
+        return sum(self._district_energy(one_votes, size) for one_votes, size
+                   in zip(self._one_votes, self._sizes))
+
+    def temperature(self):
+        return self._schedule.temperature()
+
+    def get_search_state(self):
+        return self._schedule.get_state()
+
+    def set_search_state(self, state):
+        self._schedule.set_state(state)
+
+    def _district_energy(self, one_votes, size):
+        if _one_wins(one_votes, size):
+            return -1.
+        return -self._margin_weight * (2. * one_votes / size) ** 2
+
+    def _trade_energy_change(self, idx1, tile1, idx2, tile2):
+        vote_change, size_change = self._trade_change(tile1, tile2)
+        one_votes, sizes = self._one_votes, self._sizes
+        return self._district_energy(one_votes[idx1] + vote_change,
+                                     sizes[idx1] + size_change) + \
+               self._district_energy(one_votes[idx2] - vote_change,
+                                     sizes[idx2] - size_change) - \
+               self._district_energy(one_votes[idx1], sizes[idx1]) - \
+               self._district_energy(one_votes[idx2], sizes[idx2])
+
+    def _get_trade_probability(self, idx1, tile1,
+                               idx2, tile2):
+        energy_change = self._trade_energy_change(idx1, tile1, idx2, tile2)
+        if energy_change <= 0.:
             return 1.
+        temperature = self._schedule.temperature()
+        if temperature <= 0.:
+            return 0.
+        return np.exp(-energy_change / temperature)
+
+    def _get_trade_probabilities(self, trades):
+        if len(trades) == 0:
+            return []
+        idx1, idx2, vote_change, size_change = self._trade_changes(trades)
+        one_votes = np.array(self._one_votes)
+        sizes = np.array(self._sizes)
+
+        def district_energy(one_votes, sizes):
+            return np.where(_one_wins(one_votes, sizes), -1.,
+                            -self._margin_weight *
+                            (2. * one_votes / sizes) ** 2)
+
+        energy_change = \
+            district_energy(one_votes[idx1] + vote_change,
+                            sizes[idx1] + size_change) + \
+            district_energy(one_votes[idx2] - vote_change,
+                            sizes[idx2] - size_change) - \
+            district_energy(one_votes[idx1], sizes[idx1]) - \
+            district_energy(one_votes[idx2], sizes[idx2])
+        temperature = self._schedule.temperature()
+        if temperature <= 0.:
+            return (energy_change <= 0.).astype(float).tolist()
+        return np.exp(-np.maximum(energy_change, 0.) / temperature).tolist()
+
+def districts_from_labels(labels, graph = None):
+    """
+    Returns the list of Districts described by an
+    array of district labels, as returned by
+    get_labels: 2-d for a grid, 1-d (with graph, a
+    PrecinctGraph) for a precinct graph.
+    """
+    labels = np.asarray(labels)
+    if labels.ndim == 1:
+        return [District(np.flatnonzero(labels == idx).tolist(), graph)
+                for idx in range(labels.max() + 1)]
+    n_cols = labels.shape[1]
+    return [District(divmod(node, n_cols)
+                     for node in np.flatnonzero(labels.ravel() == idx))
+            for idx in range(labels.max() + 1)]
+
+
+def _label_dtype(labels):
+    return np.int16 if labels.max() < 2 ** 15 else np.int32
+
+
+def save_checkpoint(filename, configuration, iter_num,
+                    max_wins, max_win_labels):
+    """
+    Writes the state of a search to filename as a
+    .npz archive: the current and best district
+    labels, the iteration counters, and the state of
+    the configuration's random number generator and
+    its search state (see get_search_state).  The
+    file is replaced atomically, so an interrupted
+    write leaves the previous checkpoint intact.
+    """
+    labels = configuration.get_labels()
+    version, internal_state, gauss_next = configuration._random().getstate()
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        np.savez(f,
+                 labels = labels.astype(_label_dtype(labels)),
+                 max_win_labels = max_win_labels.astype(
+                     _label_dtype(max_win_labels)),
+                 counters = np.array([iter_num, max_wins,
+                                      configuration.elapsed_iterations(),
+                                      configuration.accepted_trades()],
+                                     dtype = np.int64),
+                 rng_state = np.array([version] + list(internal_state),
+                                      dtype = np.uint32),
+                 rng_gauss_next = np.array([np.nan if gauss_next is None
+                                            else gauss_next]),
+                 search_state = np.array(configuration.get_search_state(),
+                                         dtype = float))
+    os.rename(temp_filename, filename)
+
+
+def load_checkpoint(filename):
+    """
+    Reads a checkpoint written by save_checkpoint
+    into a dictionary.
+    """
+    with np.load(filename) as checkpoint:
+        iter_num, max_wins, elapsed_iterations, accepted_trades \
+            = checkpoint['counters']
+        rng_state = checkpoint['rng_state'].tolist()
+        gauss_next = checkpoint['rng_gauss_next'][0]
+        search_state = checkpoint['search_state'].tolist() \
+                       if 'search_state' in checkpoint.files else []
+        return {'labels' : checkpoint['labels'].astype(np.int32),
+                'max_win_labels' : checkpoint['max_win_labels']
+                                   .astype(np.int32),
+                'iter_num' : int(iter_num),
+                'max_wins' : int(max_wins),
+                'elapsed_iterations' : int(elapsed_iterations),
+                'accepted_trades' : int(accepted_trades),
+                'rng_state' : (rng_state[0], tuple(rng_state[1:]),
+                               None if np.isnan(gauss_next)
+                               else float(gauss_next)),
+                'search_state' : search_state}
+
 
 def search_configurations(voter_distribution, init_districts,
                           ConfigurationClass = ClassicConfiguration,
                           configuration_kwargs = {},
                           max_iter = 10000,
                           num_district_wins_stop = None,
-                          vrb = True):
+                          vrb = True,
+                          checkpoint_file = None,
+                          checkpoint_interval = 1000,
+                          resume = False,
+                          callbacks = (),
+                          metrics_interval = None,
+                          stagnation_iter = None):
+    """
+    Runs max_iter iterations of a configuration
+    starting from init_districts, and returns the
+    maximum number of districts won by 1 along with
+    a configuration that achieves it.  Only the
+    labels of the best districts are kept during the
+    search, and the configuration is rebuilt from
+    them at the end.
+
+    If checkpoint_file is given, the search state is
+    saved there every checkpoint_interval iterations
+    and at the end.  With resume = True the search
+    continues from that file if it exists, up to
+    max_iter iterations in total.  The possible
+    trades are rebuilt in a different order on
+    resuming, so the continued chain is equally valid
+    but not identical to an uninterrupted one.
+
+    Each of callbacks is called with a metrics record
+    (see search_metrics.MetricsTracker) every
+    metrics_interval iterations (by default every
+    hundredth of max_iter), whenever the best number
+    of wins increases and at the end.  With vrb,
+    search_metrics.print_progress is one of them.
+
+    If stagnation_iter is given, the search stops
+    early once that many iterations have passed
+    without a new best number of wins.
+    """
+    checkpoint = None
+    if resume and checkpoint_file is not None and \
+       os.path.exists(checkpoint_file):
+        checkpoint = load_checkpoint(checkpoint_file)
+        init_districts = districts_from_labels(checkpoint['labels'])
     configuration = ConfigurationClass(init_districts,
                                        voter_distribution,
                                        **configuration_kwargs)
-    max_wins = configuration.num_districts_one_win_or_tie()
-    max_win_config = copy.deepcopy(configuration)
-    for iter_num in xrange(1, max_iter + 1):
-        if num_district_wins_stop is not None and \
-           max_wins >= num_district_wins_stop: break
+    if checkpoint is None:
+        start_iter = 0
+        max_wins = configuration.num_districts_one_win_or_tie()
+        max_win_labels = configuration.get_labels()
+    else:
+        start_iter = checkpoint['iter_num']
+        max_wins = checkpoint['max_wins']
+        max_win_labels = checkpoint['max_win_labels']
+        configuration._elapsed_iterations = checkpoint['elapsed_iterations']
+        configuration._accepted_trades = checkpoint['accepted_trades']
+        configuration._random().setstate(checkpoint['rng_state'])
+        configuration.set_search_state(checkpoint['search_state'])
+
+    if metrics_interval is None:
+        metrics_interval = max(1, max_iter // 100)
+    if vrb:
+        callbacks = [print_progress] + list(callbacks)
+    tracker = MetricsTracker(configuration, callbacks, start_iter)
+
+    iter_num = start_iter
+    best_iter = start_iter
+    for iter_num in xrange(start_iter + 1, max_iter + 1):
+        if (num_district_wins_stop is not None and
+            max_wins >= num_district_wins_stop) or \
+           (stagnation_iter is not None and
+            iter_num - 1 - best_iter >= stagnation_iter):
+            iter_num -= 1
+            break
         configuration.iterate()
 
         wins = configuration.num_districts_one_win_or_tie()
         if wins > max_wins:
             max_wins = wins
-            max_win_config = copy.deepcopy(configuration)
+            max_win_labels = configuration.get_labels()
+            best_iter = iter_num
+            tracker.report('best', iter_num, max_wins)
+
+        if checkpoint_file is not None and \
+           iter_num % checkpoint_interval == 0:
+            save_checkpoint(checkpoint_file, configuration, iter_num,
+                            max_wins, max_win_labels)
+
+        if iter_num % metrics_interval == 0:
+            tracker.report('progress', iter_num, max_wins)
 
-        if vrb:
-            message_at = int(max_iter / 100)
-            if iter_num % message_at == 0:
-                print iter_num, "iterations completed.",
-                print "Districts won by 1 in current configuration:",
-                print configuration.num_districts_one_win_or_tie(),
-                print "Max districts won by 1:", max_wins
+    tracker.report('end', iter_num, max_wins)
+    if checkpoint_file is not None:
+        save_checkpoint(checkpoint_file, configuration, iter_num,
+                        max_wins, max_win_labels)
 
+    max_win_config = ConfigurationClass(districts_from_labels(max_win_labels),
+                                        voter_distribution,
+                                        **configuration_kwargs)
     return max_wins, max_win_config
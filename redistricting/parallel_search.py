@@ -0,0 +1,259 @@
+"""
+Run many Monte Carlo chains of find_winning_districting
+at once on several processes, either independently or
+as a parallel tempering ladder.
+"""
+import copy
+import multiprocessing
+import random
+import numpy as np
+from find_winning_districting import ClassicConfiguration
+from find_winning_districting import districts_from_labels
+
+
+def _run_chain(chain, n_iter, num_district_wins_stop):
+    """
+    Iterate one chain (a dictionary holding the
+    configuration and its best state so far) for
+    n_iter iterations or until it reaches
+    num_district_wins_stop wins.
+    """
+    configuration = chain['configuration']
+    for _ in xrange(n_iter):
+        if num_district_wins_stop is not None and \
+           chain['max_wins'] >= num_district_wins_stop: break
+        configuration.iterate()
+        wins = configuration.num_districts_one_win_or_tie()
+        if wins > chain['max_wins']:
+            chain['max_wins'] = wins
+            chain['max_win_labels'] = configuration.get_labels()
+
+
+def _worker_died(process):
+    process.join()
+    return RuntimeError("chain worker %s exited with code %s"
+                        % (process.name, process.exitcode))
+
+
+def _send(conn, process, message):
+    """
+    Sends message to the worker process on conn,
+    raising an error if the worker has died.
+    """
+    try:
+        conn.send(message)
+    except IOError:
+        raise _worker_died(process)
+
+
+def _receive(conn, process):
+    """
+    Reads the reply of the worker process on conn,
+    raising an error if the worker has died.
+    """
+    try:
+        return conn.recv()
+    except EOFError:
+        raise _worker_died(process)
+
+
+def _chain_worker(conn, chain_specs):
+    """
+    Holds the chains given by chain_specs in this
+    process and runs them on request from conn, so
+    that the configurations never have to be sent
+    between processes while the search runs.
+    """
+    chains = {}
+    for chain_id, make_configuration, seed in chain_specs:
+        configuration = make_configuration()
+        configuration.set_rng(random.Random(seed))
+        chains[chain_id] = {
+            'configuration' : configuration,
+            'max_wins' : configuration.num_districts_one_win_or_tie(),
+            'max_win_labels' : configuration.get_labels()}
+
+    while True:
+        command, args = conn.recv()
+        if command == 'run':
+            n_iter, num_district_wins_stop = args
+            for chain in chains.itervalues():
+                _run_chain(chain, n_iter, num_district_wins_stop)
+            conn.send({chain_id : (
+                chain['configuration'].num_districts_one_win_or_tie(),
+                chain['max_wins'])
+                       for chain_id, chain in chains.iteritems()})
+        elif command == 'set_lower_prob':
+            chain_id, lower_prob = args
+            chains[chain_id]['configuration'].set_lower_prob(lower_prob)
+        elif command == 'best':
+            conn.send(chains[args]['max_win_labels'])
+        elif command == 'stop':
+            conn.close()
+            return
+
+
+class _ConfigurationFactory:
+    def __init__(self, ConfigurationClass, init_districts,
+                 voter_distribution, configuration_kwargs):
+        self._ConfigurationClass = ConfigurationClass
+        self._init_districts = init_districts
+        self._voter_distribution = voter_distribution
+        self._configuration_kwargs = configuration_kwargs
+
+    def __call__(self, districts = None):
+        if districts is None:
+            districts = copy.deepcopy(self._init_districts)
+        return self._ConfigurationClass(districts,
+                                        self._voter_distribution,
+                                        **self._configuration_kwargs)
+
+
+def search_configurations_parallel(voter_distribution, init_districts,
+                                   ConfigurationClass = ClassicConfiguration,
+                                   configuration_kwargs = {},
+                                   n_chains = 4,
+                                   lower_probs = None,
+                                   max_iter = 10000,
+                                   swap_interval = 100,
+                                   num_district_wins_stop = None,
+                                   seed = 0,
+                                   n_processes = None,
+                                   vrb = True):
+    """
+    Runs n_chains chains of max_iter iterations each,
+    spread over n_processes worker processes, and
+    returns the maximum number of districts won by 1
+    in any chain along with the configuration that
+    achieved it (as search_configurations does).
+
+    If lower_probs is given, the chains instead form
+    a parallel tempering ladder of
+    ClassicConfiguration chains, chain k starting at
+    lower_prob = lower_probs[k].  Every swap_interval
+    iterations neighboring rungs propose to exchange
+    their lower_prob values.  A chain that accepts
+    losing wins with probability q is treated as
+    sampling exp(beta * wins) with beta = -log(q), so
+    a swap is accepted with probability
+    min(1, exp((beta_i - beta_j) * (wins_j - wins_i))).
+
+    Each chain has its own random.Random seeded from
+    seed, and swaps are decided by a generator seeded
+    from seed too, so a run is reproducible however
+    its chains are spread over the processes.
+    """
+    if lower_probs is not None:
+        n_chains = len(lower_probs)
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+    n_processes = max(1, min(n_processes, n_chains))
+    master_rng = random.Random(seed)
+    chain_seeds = [master_rng.randrange(2 ** 32) for _ in range(n_chains)]
+
+    factories = []
+    for chain_id in range(n_chains):
+        kwargs = dict(configuration_kwargs)
+        if lower_probs is not None:
+            kwargs['lower_prob'] = lower_probs[chain_id]
+        factories.append(_ConfigurationFactory(ConfigurationClass,
+                                               init_districts,
+                                               voter_distribution, kwargs))
+
+    # Chain chain_id lives in process chain_id % n_processes.
+    connections = []
+    processes = []
+    for worker in range(n_processes):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        specs = [(chain_id, factories[chain_id], chain_seeds[chain_id])
+                 for chain_id in range(worker, n_chains, n_processes)]
+        process = multiprocessing.Process(target = _chain_worker,
+                                          args = (child_conn, specs))
+        process.daemon = True
+        process.start()
+        # Only the worker holds this end, so recv in this process
+        # raises EOFError instead of hanging if the worker dies.
+        child_conn.close()
+        connections.append(parent_conn)
+        processes.append(process)
+
+    # rung_probs[k] is the lower_prob of the chain on rung k of the
+    # ladder, and rung_chain[k] is that chain.
+    rung_probs = list(lower_probs) if lower_probs is not None else None
+    rung_chain = range(n_chains)
+    max_wins = None
+    best_chain = None
+    try:
+        iter_num = 0
+        round_num = 0
+        while iter_num < max_iter:
+            n_iter = min(swap_interval, max_iter - iter_num)
+            for conn, process in zip(connections, processes):
+                _send(conn, process, ('run', (n_iter, num_district_wins_stop)))
+            results = {}
+            for conn, process in zip(connections, processes):
+                results.update(_receive(conn, process))
+            iter_num += n_iter
+            round_num += 1
+
+            for chain_id, (_, chain_max_wins) in sorted(results.iteritems()):
+                if max_wins is None or chain_max_wins > max_wins:
+                    max_wins, best_chain = chain_max_wins, chain_id
+            if vrb:
+                print iter_num, "iterations completed per chain.",
+                print "Districts won by 1 in current configurations:",
+                print [results[chain_id][0] for chain_id in rung_chain],
+                print "Max districts won by 1:", max_wins
+            if num_district_wins_stop is not None and \
+               max_wins >= num_district_wins_stop: break
+
+            if rung_probs is not None:
+                _swap_rungs(rung_probs, rung_chain, results, master_rng,
+                            connections, processes, round_num)
+
+        worker = best_chain % n_processes
+        _send(connections[worker], processes[worker], ('best', best_chain))
+        max_win_labels = _receive(connections[worker], processes[worker])
+    finally:
+        for conn in connections:
+            # A dead worker's pipe is broken; its death is reported by
+            # _send, _receive or the exit code check below.
+            try:
+                conn.send(('stop', None))
+            except IOError:
+                pass
+        for process in processes:
+            process.join()
+    for process in processes:
+        if process.exitcode != 0:
+            raise _worker_died(process)
+
+    max_win_config = factories[best_chain](
+        districts_from_labels(max_win_labels))
+    if rung_probs is not None:
+        # The chain ends on the lower_prob of its last rung, not the
+        # one it started with.
+        max_win_config.set_lower_prob(rung_probs[rung_chain.index(best_chain)])
+    return max_wins, max_win_config
+
+
+def _swap_rungs(rung_probs, rung_chain, results, rng, connections,
+                processes, round_num):
+    """
+    Propose exchanges between neighboring rungs,
+    alternating between even and odd pairs of rungs
+    from one round to the next.
+    """
+    for rung in range(round_num % 2, len(rung_probs) - 1, 2):
+        chain_i, chain_j = rung_chain[rung], rung_chain[rung + 1]
+        beta_i = -np.log(rung_probs[rung])
+        beta_j = -np.log(rung_probs[rung + 1])
+        log_accept = (beta_i - beta_j) * \
+                     (results[chain_j][0] - results[chain_i][0])
+        if log_accept >= 0 or rng.random() < np.exp(log_accept):
+            rung_chain[rung], rung_chain[rung + 1] = chain_j, chain_i
+            for chain_id, lower_prob in [(chain_j, rung_probs[rung]),
+                                         (chain_i, rung_probs[rung + 1])]:
+                worker = chain_id % len(processes)
+                _send(connections[worker], processes[worker],
+                      ('set_lower_prob', (chain_id, lower_prob)))
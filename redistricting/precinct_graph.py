@@ -0,0 +1,241 @@
+"""
+Boards given as general precinct adjacency graphs
+with weighted populations, rather than as grids of
+tiles with one voter each.
+
+A graph is read from an edge list or from a CSR
+adjacency, plus vectors of the votes for 1 and the
+population of each precinct.  Files ending in .npy
+are memory mapped, and edge lists are read in
+chunks and written straight into the CSR arrays,
+so large graphs are loaded without holding more
+than one copy of the arrays.
+"""
+import itertools
+import numpy as np
+
+
+class PrecinctGraph:
+    """
+    Graph of precincts (nodes) with the number of
+    votes for 1 and the population (total number of
+    votes) of each.  Adjacency is in CSR form: the
+    neighbors of node v are
+    indices[indptr[v]:indptr[v + 1]].
+
+    The tiles of a District on this board are node
+    numbers, except for a graph made by grid_graph,
+    whose tiles are (i, j) pairs as on a grid.
+    """
+    def __init__(self, indptr, indices, votes, population = None,
+                 shape = None):
+        if population is None:
+            population = np.ones(len(votes), dtype = int)
+        if len(indptr) != len(votes) + 1 or len(population) != len(votes):
+            raise ValueError("adjacency, votes and population "
+                             "have different numbers of nodes")
+        self._indptr = indptr
+        self._indices = indices
+        self._votes = votes
+        self._population = population
+        self.shape = (len(votes),) if shape is None else shape
+
+    def __len__(self):
+        return len(self._votes)
+
+    def adjacency(self):
+        return self._indptr, self._indices
+
+    def votes(self):
+        return self._votes
+
+    def population(self):
+        return self._population
+
+    def neighbors(self, node):
+        return self._indices[self._indptr[node]:self._indptr[node + 1]]
+
+    def node(self, tile):
+        if len(self.shape) == 1:
+            return tile
+        i, j = tile
+        return i * self.shape[1] + j
+
+    def tile(self, node):
+        if len(self.shape) == 1:
+            return node
+        return divmod(node, self.shape[1])
+
+
+def _grid_adjacency(shape):
+    """
+    Returns the 4-neighbor adjacency of a grid of the
+    given shape in CSR form (indptr, indices), where
+    tile (i, j) is node i * shape[1] + j.
+    """
+    n_rows, n_cols = shape
+    nodes = np.arange(n_rows * n_cols).reshape(shape)
+    pairs = [(nodes[:-1, :], nodes[1:, :]), (nodes[1:, :], nodes[:-1, :]),
+             (nodes[:, :-1], nodes[:, 1:]), (nodes[:, 1:], nodes[:, :-1])]
+    sources = np.concatenate([source.ravel() for source, _ in pairs])
+    targets = np.concatenate([target.ravel() for _, target in pairs])
+    order = np.argsort(sources, kind = 'mergesort')
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(
+        sources, minlength = n_rows * n_cols))])
+    return indptr, targets[order]
+
+
+def grid_graph(voter_distribution):
+    """
+    The graph of a grid voter_distribution, with one
+    voter per tile and 4-neighbor adjacency.
+    """
+    voter_distribution = np.asarray(voter_distribution)
+    indptr, indices = _grid_adjacency(voter_distribution.shape)
+    return PrecinctGraph(indptr, indices, voter_distribution.ravel(),
+                         shape = voter_distribution.shape)
+
+
+def edges_to_csr(sources, targets, n_nodes = None):
+    """
+    CSR adjacency (indptr, indices) of the undirected
+    graph with edges (sources[k], targets[k]).
+    Duplicate edges and self loops are dropped.
+    """
+    sources = np.asarray(sources, dtype = np.int64)
+    targets = np.asarray(targets, dtype = np.int64)
+    if n_nodes is None:
+        n_nodes = int(max(sources.max(), targets.max())) + 1 \
+                  if len(sources) else 0
+    _check_node_ids(sources, n_nodes)
+    _check_node_ids(targets, n_nodes)
+    keep = sources != targets
+    sources, targets = sources[keep], targets[keep]
+    keys = np.unique(np.concatenate([sources * n_nodes + targets,
+                                     targets * n_nodes + sources]))
+    heads = keys // n_nodes
+    indptr = np.concatenate(
+        [[0], np.cumsum(np.bincount(heads, minlength = n_nodes))])
+    return indptr.astype(np.int64), (keys % n_nodes).astype(np.int32)
+
+
+def _check_node_ids(nodes, n_nodes = None):
+    if len(nodes) == 0:
+        return
+    if nodes.min() < 0 or (n_nodes is not None and nodes.max() >= n_nodes):
+        raise ValueError("node ids must be between 0 and %s, got %d to %d"
+                         % ('n_nodes - 1' if n_nodes is None
+                            else n_nodes - 1, nodes.min(), nodes.max()))
+
+
+def _read_edge_chunks(filename, chunk_lines):
+    """
+    Yields the edges of a text edge list (two node
+    numbers per line, lines starting with # ignored)
+    as arrays of chunk_lines edges at most.
+    """
+    with open(filename) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if len(lines) == 0:
+                return
+            yield np.array([line.split()[:2] for line in lines
+                            if line.strip() and not line.startswith('#')],
+                           dtype = np.int32).reshape(-1, 2)
+
+
+def _edge_chunks(filename, chunk_lines):
+    if filename.endswith('.npy'):
+        edges = np.load(filename, mmap_mode = 'r')
+        for start in xrange(0, len(edges), chunk_lines):
+            yield np.asarray(edges[start:start + chunk_lines])
+    else:
+        for edges in _read_edge_chunks(filename, chunk_lines):
+            yield edges
+
+
+def _directed_edges(edges):
+    """
+    Both directions of the edges of a chunk, without
+    self loops, as (sources, targets).
+    """
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    return np.concatenate([edges[:, 0], edges[:, 1]]), \
+           np.concatenate([edges[:, 1], edges[:, 0]])
+
+
+def load_edge_list(filename, n_nodes = None, chunk_lines = 1000000):
+    """
+    Reads an undirected edge list, either a .npy array
+    of shape (n_edges, 2) or a text file with one
+    edge per line, and returns its CSR adjacency as
+    edges_to_csr does.  The file is read twice,
+    chunk_lines edges at a time: once to count the
+    neighbors of each node, and once to write them
+    into the CSR arrays.  Node ids must be below
+    n_nodes if it is given.
+    """
+    degrees = np.zeros(0 if n_nodes is None else n_nodes, dtype = np.int64)
+    for edges in _edge_chunks(filename, chunk_lines):
+        _check_node_ids(edges.ravel(), n_nodes)
+        sources, _ = _directed_edges(edges)
+        counts = np.bincount(sources, minlength = len(degrees))
+        counts[:len(degrees)] += degrees
+        degrees = counts
+    n_nodes = len(degrees)
+
+    indptr = np.concatenate([[0], np.cumsum(degrees)]).astype(np.int64)
+    indices = np.empty(indptr[-1], dtype = np.int32)
+    fill = indptr[:-1].copy()
+    for edges in _edge_chunks(filename, chunk_lines):
+        sources, targets = _directed_edges(edges)
+        order = np.argsort(sources, kind = 'mergesort')
+        sources, targets = sources[order], targets[order]
+        # Position of each edge among the edges of its source in this
+        # chunk.
+        rank = np.arange(len(sources)) - np.searchsorted(sources, sources)
+        indices[fill[sources] + rank] = targets
+        fill += np.bincount(sources, minlength = n_nodes)
+
+    # Sort the neighbors of each node and drop duplicate edges.
+    rows = np.repeat(np.arange(n_nodes, dtype = np.int32), degrees)
+    order = np.lexsort((indices, rows))
+    indices = indices[order]
+    keep = np.ones(len(indices), dtype = bool)
+    keep[1:] = (rows[1:] != rows[:-1]) | (indices[1:] != indices[:-1])
+    indptr = np.concatenate(
+        [[0], np.cumsum(np.bincount(rows[keep], minlength = n_nodes))])
+    return indptr.astype(np.int64), indices[keep]
+
+
+def load_vector(filename, dtype = float):
+    """
+    Reads a per-node vector from a .npy file (memory
+    mapped) or a text file with one value per line.
+    """
+    if filename.endswith('.npy'):
+        return np.load(filename, mmap_mode = 'r')
+    return np.loadtxt(filename, dtype = dtype, ndmin = 1)
+
+
+def load_precinct_graph(votes_file, population_file = None,
+                        edge_list_file = None, indptr_file = None,
+                        indices_file = None):
+    """
+    Reads a PrecinctGraph from a vector of votes for
+    1, an optional vector of populations (1 per node
+    by default), and either an edge list or the two
+    arrays of a CSR adjacency.
+    """
+    votes = load_vector(votes_file)
+    population = None
+    if population_file is not None:
+        population = load_vector(population_file)
+    if edge_list_file is not None:
+        indptr, indices = load_edge_list(edge_list_file, len(votes))
+    elif indptr_file is not None and indices_file is not None:
+        indptr, indices = load_vector(indptr_file, np.int64), \
+                          load_vector(indices_file, np.int64)
+    else:
+        raise ValueError("either an edge list or a CSR adjacency is needed")
+    return PrecinctGraph(indptr, indices, votes, population)
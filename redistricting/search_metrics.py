@@ -0,0 +1,127 @@
+"""
+Progress metrics of a Monte Carlo search of
+districtings, and callbacks that print or store them.
+"""
+import csv
+import json
+import os
+import time
+
+
+class MetricsTracker:
+    """
+    Builds a record of the state of a search and
+    passes it to each of callbacks.  A record is a
+    dictionary with the fields
+
+        event                'progress', 'best' or 'end'
+        iter_num             iterations of the search so far
+        elapsed_iterations   see BaseConfiguration
+        wins                 districts won by 1 now
+        max_wins             best wins so far
+        possible_trades      number of possible trades
+        accepted_trades      trades made so far
+        acceptance_rate      accepted trades per elapsed
+                             iteration since the last
+                             progress record (since the
+                             start for 'end')
+        iterations_per_second  over the same interval
+        wall_time            seconds since the start
+        enumeration_time     seconds spent updating the
+                             possible trades
+        evaluation_time      seconds spent computing trade
+                             probabilities
+
+    A 'best' record is made whenever max_wins
+    increases, so these records give the best-wins
+    trajectory of the search.
+    """
+    def __init__(self, configuration, callbacks, iter_num = 0):
+        self._configuration = configuration
+        self._callbacks = list(callbacks)
+        if self._callbacks:
+            configuration.enable_timing()
+        self._start_time = time.time()
+        self._first = (self._start_time, iter_num,
+                       configuration.elapsed_iterations(),
+                       configuration.accepted_trades())
+        self._last = self._first
+
+    def report(self, event, iter_num, max_wins):
+        if not self._callbacks:
+            return
+        configuration = self._configuration
+        now = time.time()
+        elapsed = configuration.elapsed_iterations()
+        accepted = configuration.accepted_trades()
+        # The last progress record usually falls on the last
+        # iteration, so the end record covers the whole search.
+        last_time, last_iter, last_elapsed, last_accepted \
+            = self._first if event == 'end' else self._last
+        timings = configuration.timings()
+        record = {
+            'event' : event,
+            'iter_num' : iter_num,
+            'elapsed_iterations' : elapsed,
+            'wins' : configuration.num_districts_one_win_or_tie(),
+            'max_wins' : max_wins,
+            'possible_trades' : configuration.num_possible_trades(),
+            'accepted_trades' : accepted,
+            'acceptance_rate' : float(accepted - last_accepted) /
+                                max(elapsed - last_elapsed, 1),
+            'iterations_per_second' : (iter_num - last_iter) /
+                                      max(now - last_time, 1e-9),
+            'wall_time' : now - self._start_time,
+            'enumeration_time' : timings['enumeration'],
+            'evaluation_time' : timings['evaluation'],
+            }
+        if event == 'progress':
+            self._last = (now, iter_num, elapsed, accepted)
+        for callback in self._callbacks:
+            callback(record)
+
+
+def print_progress(record):
+    """
+    Callback printing the progress messages of
+    search_configurations.
+    """
+    if record['event'] == 'progress':
+        print record['iter_num'], "iterations completed.",
+        print "Districts won by 1 in current configuration:",
+        print record['wins'],
+        print "Max districts won by 1:", record['max_wins']
+
+
+class MetricsWriter:
+    """
+    Callback appending each record to filename, as
+    CSV if the name ends in .csv and as JSON lines
+    otherwise.  The file is flushed after every
+    record, so it is complete up to the last record
+    even if the search is interrupted.
+    """
+    def __init__(self, filename, events = ('progress', 'best', 'end')):
+        self._write_header = not os.path.exists(filename) or \
+                             os.path.getsize(filename) == 0
+        self._file = open(filename, 'a')
+        self._events = set(events)
+        self._csv = filename.endswith('.csv')
+        self._writer = None
+
+    def __call__(self, record):
+        if record['event'] not in self._events:
+            return
+        if not self._csv:
+            self._file.write(json.dumps(record, sort_keys = True) + '\n')
+        else:
+            if self._writer is None:
+                self._writer = csv.DictWriter(self._file,
+                                              sorted(record.keys()))
+                if self._write_header:
+                    self._writer.writeheader()
+            self._writer.writerow(record)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
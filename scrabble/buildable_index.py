@@ -0,0 +1,125 @@
+"""
+On-disk index of buildable words, so that queries
+can be answered without loading the dictionary.
+
+Build an index with
+
+    python buildable_index.py build dictionary_file index_dir
+
+and query it with
+
+    python buildable_index.py query index_dir [--longest]
+        [--buildable WORD] [--buildseq WORD]
+"""
+import os
+import numpy as np
+from sorted_words import SortedWords
+from sorted_words import pack_words
+
+INDEX_ARRAYS = ['chars', 'offsets', 'lengths', 'prefix', 'suffix',
+                'length_range', 'longest']
+
+
+def write_index(buildable_words, index_dir):
+    """
+    Writes the output of find_buildable_words to
+    index_dir.  The buildable words are sorted, and
+    word i is stored as chars[offsets[i]:offsets[i + 1]]
+    with its length in lengths[i].  prefix[i] and
+    suffix[i] are the indices of the word without its
+    last and first letter, or -1 if that is not one of
+    the buildable words.  length_range holds the
+    shortest and longest word lengths, and longest
+    the indices of the longest words, so that queries
+    need not scan lengths.
+    """
+    words = sorted(word for word_set in buildable_words.itervalues()
+                   for word in word_set)
+    word_idx = {word : idx for idx, word in enumerate(words)}
+    chars, offsets = pack_words(words)
+    lengths = np.array([len(word) for word in words], dtype = np.int32)
+    if len(words) > 0:
+        length_range = np.array([lengths.min(), lengths.max()],
+                                dtype = np.int32)
+        longest = np.flatnonzero(lengths == lengths.max()).astype(np.int32)
+    else:
+        length_range = longest = np.zeros(0, dtype = np.int32)
+    arrays = {
+        'chars' : chars,
+        'offsets' : offsets,
+        'lengths' : lengths,
+        'prefix' : np.array([word_idx.get(word[:-1], -1) for word in words],
+                            dtype = np.int32),
+        'suffix' : np.array([word_idx.get(word[1:], -1) for word in words],
+                            dtype = np.int32),
+        'length_range' : length_range,
+        'longest' : longest,
+        }
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    for name in INDEX_ARRAYS:
+        np.save(os.path.join(index_dir, name + '.npy'), arrays[name])
+
+
+class BuildableIndex(SortedWords):
+    """
+    Read-only view of an index written by write_index,
+    whose buildable words are looked up as in
+    sorted_words.SortedWords.  The arrays are memory
+    mapped, so a query only reads the parts of the
+    index it needs.
+    """
+    def __init__(self, index_dir):
+        for name in INDEX_ARRAYS:
+            setattr(self, '_' + name,
+                    np.load(os.path.join(index_dir, name + '.npy'),
+                            mmap_mode = 'r'))
+        SortedWords.__init__(self, self._chars, self._offsets)
+
+    def max_buildable_words(self):
+        """
+        Returns the list of longest buildable words.
+        """
+        return [self.word(idx) for idx in self._longest]
+
+    def get_build_sequence(self, word):
+        """
+        get_build_sequence of longest_buildable_word,
+        answered from the index alone.
+        """
+        return self.build_sequence(word, self._prefix, self._suffix,
+                                   self._length_range[0])
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest = 'command')
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('dictionary_file')
+    build_parser.add_argument('index_dir')
+    query_parser = subparsers.add_parser('query')
+    query_parser.add_argument('index_dir')
+    query_parser.add_argument('-l', '--longest', required = False,
+                              action = 'store_true')
+    query_parser.add_argument('-w', '--buildable', required = False)
+    query_parser.add_argument('-b', '--buildseq', required = False)
+
+    args = vars(parser.parse_args())
+
+    if args['command'] == 'build':
+        from longest_buildable_word import load_words
+        from longest_buildable_word import find_buildable_words
+        write_index(find_buildable_words(load_words(args['dictionary_file'])),
+                    args['index_dir'])
+        print "Index written to", args['index_dir']
+    else:
+        index = BuildableIndex(args['index_dir'])
+        if args['longest']:
+            for word in index.max_buildable_words():
+                print word
+        if args['buildable'] is not None:
+            print args['buildable'], "buildable:", args['buildable'] in index
+        if args['buildseq'] is not None:
+            for building_blocks in index.get_build_sequence(args['buildseq']):
+                print ' '.join(building_blocks)
@@ -0,0 +1,142 @@
+"""
+Buildable words of a dictionary that changes over
+time, kept up to date as words are added and removed.
+"""
+from collections import defaultdict
+from longest_buildable_word import BUILD_RULES
+from longest_buildable_word import find_buildable_words
+
+
+class IncrementalBuildableWords:
+    """
+    Keeps the output of find_buildable_words for a
+    dictionary under insertions and deletions of
+    words.  Every word is indexed under the keys of
+    the words it can be built from, so a change only
+    re-evaluates the longer words reachable from the
+    changed word.  Adding a word shorter than any
+    other, or removing the last word of the minimum
+    length, changes which words are the starting
+    points and triggers a full recomputation.
+    """
+    def __init__(self, words = (), rule = 'ends'):
+        self._rule = rule
+        self._key, self._parent_keys = BUILD_RULES[rule]
+        self._words = {}
+        # length -> parent key -> words of that length built from it
+        self._children = defaultdict(lambda : defaultdict(set))
+        for word in words:
+            self._insert(word)
+        self._recompute()
+
+    def __contains__(self, word):
+        return word in self._buildable.get(len(word), ())
+
+    def buildable_words(self):
+        """
+        Returns the current output of find_buildable_words.
+        """
+        return {word_length : set(words) for word_length, words
+                in self._buildable.iteritems()}
+
+    def max_buildable_words(self):
+        if len(self._buildable) == 0:
+            return set()
+        return set(self._buildable[max(self._buildable)])
+
+    def update(self, added = (), removed = ()):
+        for word in removed:
+            self.remove_word(word)
+        for word in added:
+            self.add_word(word)
+
+    def add_word(self, word):
+        if word in self._words.get(len(word), ()):
+            return
+        restart = len(self._words) == 0 or len(word) < self._min_length
+        self._insert(word)
+        if restart:
+            self._recompute()
+        elif len(word) == self._min_length or \
+             self._has_buildable_parent(word):
+            self._make_buildable(word)
+
+    def remove_word(self, word):
+        if word not in self._words.get(len(word), ()):
+            return
+        self._words[len(word)].remove(word)
+        for parent_key in self._parent_keys(word):
+            self._children[len(word)][parent_key].discard(word)
+        if len(self._words[len(word)]) == 0:
+            del self._words[len(word)]
+            if len(word) == self._min_length:
+                self._recompute()
+                return
+        if word in self:
+            self._make_unbuildable(word)
+
+    def _insert(self, word):
+        self._words.setdefault(len(word), set()).add(word)
+        for parent_key in self._parent_keys(word):
+            self._children[len(word)][parent_key].add(word)
+
+    def _recompute(self):
+        self._buildable = {}
+        self._key_counts = defaultdict(lambda : defaultdict(int))
+        if len(self._words) == 0:
+            return
+        self._min_length = min(self._words)
+        buildable_words = find_buildable_words(defaultdict(set, self._words),
+                                               self._rule)
+        for word_length, words in buildable_words.iteritems():
+            self._buildable[word_length] = set(words)
+            for word in words:
+                self._key_counts[word_length][self._word_key(word)] += 1
+
+    def _word_key(self, word):
+        return word if self._key is None else self._key(word)
+
+    def _has_buildable_parent(self, word):
+        counts = self._key_counts.get(len(word) - 1, {})
+        return any(counts.get(parent_key, 0) > 0
+                   for parent_key in self._parent_keys(word))
+
+    def _make_buildable(self, word):
+        """
+        Marks word as buildable, then every longer word
+        that becomes buildable through it.
+        """
+        queue = [word]
+        while queue:
+            new_queue = []
+            for word in queue:
+                self._buildable.setdefault(len(word), set()).add(word)
+                key = self._word_key(word)
+                self._key_counts[len(word)][key] += 1
+                children = self._children.get(len(word) + 1, {})
+                for child in children.get(key, ()):
+                    if child not in self:
+                        new_queue.append(child)
+            queue = [child for child in set(new_queue) if child not in self]
+
+    def _make_unbuildable(self, word):
+        """
+        Unmarks word, then every longer word that has no
+        buildable parent left, one length at a time.
+        """
+        queue = [word]
+        while queue:
+            candidates = set()
+            for word in queue:
+                self._buildable[len(word)].remove(word)
+                if len(self._buildable[len(word)]) == 0:
+                    del self._buildable[len(word)]
+                key = self._word_key(word)
+                self._key_counts[len(word)][key] -= 1
+                if self._key_counts[len(word)][key] == 0:
+                    del self._key_counts[len(word)][key]
+                    candidates.update(
+                        self._children.get(len(word) + 1, {}).get(key, ()))
+            queue = [child for child in candidates
+                     if child in self and
+                     not self._has_buildable_parent(child)]
@@ -17,47 +17,151 @@ def load_words(filename):
         words[len(word)].add(word)
     return words
 
-def find_buildable_words(all_words):
+def _end_deletions(word):
+    return {word[:-1], word[1:]}
+
+def _deletions(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+def _signature(word):
+    return ''.join(sorted(word))
+
+def _signature_deletions(word):
+    return _deletions(_signature(word))
+
+# For each build rule: the key under which words are
+# indexed (None for the word itself), and a function
+# returning the keys of the words one letter shorter
+# that a word can be built from.  'ends' adds a letter
+# at the front or back, 'insert' adds a letter anywhere
+# and 'anagram' adds a letter and reorders the letters.
+BUILD_RULES = {'ends' : (None, _end_deletions),
+               'insert' : (None, _deletions),
+               'anagram' : (_signature, _signature_deletions)}
+
+def _index_keys(words, key):
+    if key is None:
+        return words
+    return {key(word) for word in words}
+
+def find_buildable_words(all_words, rule = 'ends'):
     """
     Input is a dictionary of sets of words of each
     length, where the key is the length. Output is
     the same structure but with the sets containing
     only 'buildable' words.  A buildable word is
     one that can be built one letter at a time from
-    other words in the dictionary.
+    other words in the dictionary, where rule (one
+    of BUILD_RULES) says how a letter may be added.
+    Each word is checked by looking up each of its
+    possible parents in a hash index of the shorter
+    buildable words.
     """
+    key, parent_keys = BUILD_RULES[rule]
     min_length = min(all_words.iterkeys())
     max_length = max(all_words.iterkeys())
     buildable_words = {min_length : all_words[min_length]}
+    buildable_keys = _index_keys(buildable_words[min_length], key)
     for word_length in range(min_length + 1, max_length + 1):
         buildable_words[word_length] = set()
         for word in all_words[word_length]:
-            if word[:-1] in buildable_words[word_length - 1] or \
-               word[1:] in buildable_words[word_length - 1]:
+            if any(parent in buildable_keys for parent in parent_keys(word)):
                 buildable_words[word_length].add(word)
         if len(buildable_words[word_length]) == 0:
             del buildable_words[word_length]
             break
+        buildable_keys = _index_keys(buildable_words[word_length], key)
     return buildable_words
 
-def get_build_sequence(word, buildable_words):
+def _parent_finder(buildable_words, rule):
+    """
+    Returns a function that gives the distinct
+    buildable words that a word can be built from
+    by adding one letter under rule.
+    """
+    key, parent_keys = BUILD_RULES[rule]
+    indexes = {}
+
+    def find_parents(word):
+        word_length = len(word) - 1
+        level = buildable_words.get(word_length, ())
+        if key is None:
+            return [parent for parent in parent_keys(word)
+                    if parent in level]
+        if word_length not in indexes:
+            index = defaultdict(list)
+            for level_word in level:
+                index[key(level_word)].append(level_word)
+            indexes[word_length] = index
+        index = indexes[word_length]
+        return [parent for parent_key in parent_keys(word)
+                for parent in index.get(parent_key, ())]
+
+    return find_parents
+
+def get_build_sequence(word, buildable_words, rule = 'ends'):
     """
     Using the output of find_buildable_words, return
     the sequence of words out of which the input
     word can be built.
     """
+    find_parents = _parent_finder(buildable_words, rule)
     output_seq = [[word]]
     min_length = min(buildable_words.iterkeys())
     for word_length in range(len(word) - 1, min_length - 1, -1):
         new_words = set()
         for prev_word in output_seq[-1]:
-            if prev_word[:-1] in buildable_words[word_length]:
-                new_words.add(prev_word[:-1])
-            if prev_word[1:] in buildable_words[word_length]:
-                new_words.add(prev_word[1:])
+            new_words.update(find_parents(prev_word))
         output_seq.append(list(new_words))
     return output_seq
 
+def iter_build_paths(word, buildable_words, rule = 'ends'):
+    """
+    Using the output of find_buildable_words, yield
+    each way of building the input word one letter
+    at a time, as the list of words from the input
+    word down to a word of the minimum length.
+    Paths are generated depth first, so only one
+    path is held in memory at a time.
+    """
+    find_parents = _parent_finder(buildable_words, rule)
+    min_length = min(buildable_words.iterkeys())
+    if len(word) == min_length:
+        yield [word]
+        return
+    path = [word]
+    stack = [iter(find_parents(word))]
+    while stack:
+        parent = next(stack[-1], None)
+        if parent is None:
+            stack.pop()
+            path.pop()
+            continue
+        path.append(parent)
+        if len(parent) == min_length:
+            yield list(path)
+            path.pop()
+        else:
+            stack.append(iter(find_parents(parent)))
+
+def count_build_paths(buildable_words, rule = 'ends'):
+    """
+    Using the output of find_buildable_words, return
+    a dictionary from each buildable word to the
+    number of distinct ways of building it (the
+    number of paths iter_build_paths would yield),
+    computed one word length at a time.
+    """
+    find_parents = _parent_finder(buildable_words, rule)
+    min_length = min(buildable_words.iterkeys())
+    max_length = max(buildable_words.iterkeys())
+    num_paths = {word : 1 for word in buildable_words[min_length]}
+    for word_length in range(min_length + 1, max_length + 1):
+        for word in buildable_words[word_length]:
+            num_paths[word] = sum(num_paths[parent]
+                                  for parent in find_parents(word))
+    return num_paths
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
@@ -65,19 +169,58 @@ if __name__ == "__main__":
     parser.add_argument('outfile')
     parser.add_argument('-b', '--buildseq', required = False,
                         action = 'store_true')
+    parser.add_argument('-t', '--trie', required = False,
+                        action = 'store_true')
+    parser.add_argument('-c', '--count_paths', required = False,
+                        action = 'store_true')
+    parser.add_argument('-r', '--rule', required = False, default = 'ends',
+                        choices = sorted(BUILD_RULES))
+    parser.add_argument('-s', '--shards', required = False, type = int,
+                        default = None)
+    parser.add_argument('-p', '--processes', required = False, type = int,
+                        default = None)
 
     args = vars(parser.parse_args())
+    if args['trie'] and args['rule'] != 'ends':
+        parser.error("--trie only supports the 'ends' rule")
+    if args['trie'] and args['shards'] is not None:
+        parser.error("--trie cannot be combined with --shards")
+
+    if args['trie']:
+        from word_trie import BuildableWords
+        engine = BuildableWords(line.strip()
+                                for line in open(args['dictionary_file']))
+        max_buildable_words = engine.max_buildable_words()
+        build_sequence = engine.get_build_sequence
+    else:
+        if args['shards'] is not None:
+            from sharded_buildable import find_buildable_words_sharded
+            buildable_words = find_buildable_words_sharded(
+                args['dictionary_file'], args['rule'], args['shards'],
+                args['processes'])
+        else:
+            all_words = load_words(args['dictionary_file'])
+            buildable_words = find_buildable_words(all_words, args['rule'])
 
-    all_words = load_words(args['dictionary_file'])
-    buildable_words = find_buildable_words(all_words)
+        max_buildable_words = max(buildable_words.iteritems(),
+                                  key = lambda (word_length, _) : word_length)[1]
+        build_sequence = lambda word : get_build_sequence(word,
+                                                          buildable_words,
+                                                          args['rule'])
 
-    max_buildable_words = max(buildable_words.iteritems(),
-                              key = lambda (word_length, _) : word_length)[1]
-    if args['buildseq']:
+    if args['count_paths']:
+        if args['trie']:
+            buildable_words = engine.buildable_words()
+        num_paths = count_build_paths(buildable_words, args['rule'])
+        with open(args['outfile'], 'w') as fout:
+            for word, count in sorted(num_paths.iteritems(),
+                                      key = lambda (word, count) : -count):
+                print >> fout, word, count
+        print "Results written to", args['outfile']
+    elif args['buildseq']:
         with open(args['outfile'], 'w') as fout:
             for word in max_buildable_words:
-                for building_blocks in get_build_sequence(word,
-                                                          buildable_words):
+                for building_blocks in build_sequence(word):
                     print >> fout, ' '.join(building_blocks)
                 print >> fout
         print "Results written to", args['outfile']
@@ -0,0 +1,265 @@
+"""
+find_buildable_words for dictionaries too large to
+hold in one process.  The word list (optionally
+gzipped) is streamed in large chunks and split on
+disk into shards by word length and a hash of the
+word.  Each length level is then evaluated on a
+process pool in two steps:
+
+    1. each shard of words of the level sends every
+       parent key of its words to the shard owning
+       that key, and
+    2. each key shard looks the keys up among the
+       buildable keys of the previous level it owns,
+       and sends the words found to the shard owning
+       their own key,
+
+so that a worker only ever holds one shard.
+
+This costs several times the work of
+find_buildable_words in writing and reading the
+shard files, so it only pays off with many cores or
+on dictionaries that do not fit in memory.
+"""
+import gzip
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zlib
+from longest_buildable_word import BUILD_RULES
+
+
+def _open(filename, mode = 'r'):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 'b')
+    return open(filename, mode)
+
+
+def iter_word_chunks(filename, chunk_bytes = 1 << 24):
+    """
+    Yields the words of filename (one per line,
+    gzipped if the name ends in .gz) as lists, reading
+    chunk_bytes at a time.  As in load_words, each
+    line is stripped and a blank line is kept as the
+    empty word.
+    """
+    rest = ''
+    with _open(filename) as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            lines = (rest + chunk).split('\n')
+            rest = lines.pop()
+            yield [line.strip() for line in lines]
+    if rest:
+        yield [rest.strip()]
+
+
+def _shard(key, n_shards):
+    return zlib.crc32(key) % n_shards
+
+
+class _ShardWriter:
+    """
+    Buffers lines for many shard files and appends
+    them to the files whenever more than
+    buffer_lines are held.
+    """
+    def __init__(self, buffer_lines = 1000000):
+        self._buffers = {}
+        self._n_lines = 0
+        self._buffer_lines = buffer_lines
+
+    def add(self, filename, line):
+        self._buffers.setdefault(filename, []).append(line)
+        self._n_lines += 1
+        if self._n_lines >= self._buffer_lines:
+            self.flush()
+
+    def flush(self):
+        for filename, lines in self._buffers.iteritems():
+            with open(filename, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+        self._buffers = {}
+        self._n_lines = 0
+
+
+def _path(work_dir, kind, word_length, shard):
+    return os.path.join(work_dir, '%s_%d_%d.txt' % (kind, word_length, shard))
+
+
+def _read_lines(filename):
+    """
+    Yields the lines written to filename by
+    _ShardWriter or _write_keys.  Every line is a
+    record, so an empty line is the empty word (or
+    its key).
+    """
+    if not os.path.exists(filename):
+        return
+    with open(filename) as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def shard_words(filename, work_dir, n_shards, chunk_bytes = 1 << 24):
+    """
+    Splits the words of filename into the files
+    words_<length>_<shard>.txt of work_dir by length
+    and hash, and returns the lengths present.
+    """
+    writer = _ShardWriter()
+    lengths = set()
+    for words in iter_word_chunks(filename, chunk_bytes):
+        for word in words:
+            lengths.add(len(word))
+            writer.add(_path(work_dir, 'words', len(word),
+                             _shard(word, n_shards)), word)
+    writer.flush()
+    return lengths
+
+
+def _route_parent_keys(args):
+    """
+    Step 1 for one shard of words of word_length:
+    writes each (parent key, word) pair to the query
+    file of the shard owning the key, as the key
+    followed by the word (see _split_query).
+    """
+    work_dir, rule, word_length, shard, n_shards = args
+    _, parent_keys = BUILD_RULES[rule]
+    writer = _ShardWriter()
+    words = _path(work_dir, 'words', word_length, shard)
+    for word in set(_read_lines(words)):
+        for parent in parent_keys(word):
+            writer.add(_path(work_dir, 'queries_%d' % shard, word_length,
+                             _shard(parent, n_shards)),
+                       parent + word)
+    writer.flush()
+    if os.path.exists(words):
+        os.remove(words)
+
+
+def _split_query(line):
+    """
+    Splits a query line into the parent key and the
+    word.  A parent key is one letter shorter than
+    its word, so no separator is needed, and words
+    may hold any character but a newline.
+    """
+    parent_length = len(line) // 2
+    return line[:parent_length], line[parent_length:]
+
+
+def _check_parent_keys(args):
+    """
+    Step 2 for one key shard: finds the queried words
+    whose parent key is a buildable key of the
+    previous level, and writes them to the found file
+    of the shard owning their own key.
+    """
+    work_dir, rule, word_length, shard, n_shards = args
+    key, _ = BUILD_RULES[rule]
+    keys = _path(work_dir, 'keys', word_length - 1, shard)
+    buildable_keys = set(_read_lines(keys))
+    if os.path.exists(keys):
+        os.remove(keys)
+    writer = _ShardWriter()
+    for source in range(n_shards):
+        queries = _path(work_dir, 'queries_%d' % source, word_length, shard)
+        for line in _read_lines(queries):
+            parent, word = _split_query(line)
+            if parent in buildable_keys:
+                word_key = word if key is None else key(word)
+                writer.add(_path(work_dir, 'found_%d' % shard, word_length,
+                                 _shard(word_key, n_shards)), word)
+        if os.path.exists(queries):
+            os.remove(queries)
+    writer.flush()
+
+
+def _merge_found(args):
+    """
+    Merges the words of word_length found buildable
+    that belong to one key shard, writes their keys
+    for the next level and returns the words.
+    """
+    work_dir, rule, word_length, shard, n_shards = args
+    key, _ = BUILD_RULES[rule]
+    words = set()
+    for source in range(n_shards):
+        found = _path(work_dir, 'found_%d' % source, word_length, shard)
+        words.update(_read_lines(found))
+        if os.path.exists(found):
+            os.remove(found)
+    _write_keys(work_dir, key, word_length, shard, words)
+    return words
+
+
+def _write_keys(work_dir, key, word_length, shard, words):
+    keys = words if key is None else {key(word) for word in words}
+    with open(_path(work_dir, 'keys', word_length, shard), 'w') as f:
+        for word_key in keys:
+            f.write(word_key + '\n')
+
+
+def _start_level(args):
+    """
+    Keys of the words of the minimum length, which
+    are all buildable, regrouped by key shard.
+    """
+    work_dir, rule, word_length, shard, n_shards = args
+    key, _ = BUILD_RULES[rule]
+    writer = _ShardWriter()
+    words = _path(work_dir, 'words', word_length, shard)
+    for word in set(_read_lines(words)):
+        word_key = word if key is None else key(word)
+        writer.add(_path(work_dir, 'found_%d' % shard, word_length,
+                         _shard(word_key, n_shards)), word)
+    writer.flush()
+    if os.path.exists(words):
+        os.remove(words)
+
+
+def find_buildable_words_sharded(filename, rule = 'ends', n_shards = 16,
+                                 n_processes = None, work_dir = None,
+                                 chunk_bytes = 1 << 24):
+    """
+    Same output as find_buildable_words on the words
+    of filename, computed one length level at a time
+    on n_processes processes with the words split
+    into n_shards shards.  Intermediate files are
+    kept in a temporary directory inside work_dir
+    (the system default if None), removed afterwards.
+    """
+    if work_dir is not None and not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    work_dir = tempfile.mkdtemp(prefix = 'buildable_', dir = work_dir)
+    pool = multiprocessing.Pool(n_processes)
+    try:
+        lengths = shard_words(filename, work_dir, n_shards, chunk_bytes)
+        if len(lengths) == 0:
+            return {}
+        min_length, max_length = min(lengths), max(lengths)
+        buildable_words = {}
+        for word_length in range(min_length, max_length + 1):
+            tasks = [(work_dir, rule, word_length, shard, n_shards)
+                     for shard in range(n_shards)]
+            if word_length == min_length:
+                pool.map(_start_level, tasks)
+            else:
+                pool.map(_route_parent_keys, tasks)
+                pool.map(_check_parent_keys, tasks)
+            words = set()
+            for shard_words_found in pool.map(_merge_found, tasks):
+                words.update(shard_words_found)
+            if len(words) == 0:
+                break
+            buildable_words[word_length] = words
+        return buildable_words
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(work_dir)
@@ -0,0 +1,79 @@
+"""
+Sorted list of words stored as flat arrays, shared
+by the word trie and the on-disk buildable-word index.
+"""
+import numpy as np
+
+
+def pack_words(words):
+    """
+    The letters of a list of words as one uint8
+    buffer, and the offsets of the words in it.
+    """
+    chars = np.fromstring(''.join(words), dtype = np.uint8)
+    offsets = np.zeros(len(words) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(word) for word in words])
+    return chars, offsets
+
+
+class SortedWords:
+    """
+    Sorted list of distinct words, word i being
+    chars[offsets[i]:offsets[i + 1]] (see pack_words).
+    The arrays may be memory mapped.  Word i is given
+    the id i, and words are looked up by binary search.
+    """
+    def __init__(self, chars, offsets):
+        self._chars = chars
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __contains__(self, word):
+        return self.word_id(word) >= 0
+
+    def word_id(self, word):
+        """
+        Returns the id of word, or -1 if it is
+        not one of the words.
+        """
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.word(mid) < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.word(lo) == word:
+            return lo
+        return -1
+
+    def word(self, word_id):
+        return self._chars[self._offsets[word_id]:
+                           self._offsets[word_id + 1]].tostring()
+
+    def word_lengths(self):
+        return np.diff(self._offsets).astype(np.int32)
+
+    def build_sequence(self, word, prefix, suffix, min_length, keep = None):
+        """
+        Same as get_build_sequence in longest_buildable_word
+        for the 'ends' rule.  prefix[i] and suffix[i] are
+        the ids of word i without its last and first
+        letter, or -1 if that is not a word, and only the
+        words with keep[i] set (all of them if keep is
+        None) are used.
+        """
+        output_seq = [[word]]
+        current = None
+        for _ in range(len(word) - 1, min_length - 1, -1):
+            if current is None:
+                parents = [self.word_id(word[:-1]), self.word_id(word[1:])]
+            else:
+                parents = [parent for word_id in current
+                           for parent in (prefix[word_id], suffix[word_id])]
+            current = {parent for parent in parents
+                       if parent >= 0 and (keep is None or keep[parent])}
+            output_seq.append([self.word(word_id) for word_id in current])
+        return output_seq
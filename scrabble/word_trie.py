@@ -0,0 +1,249 @@
+"""
+Compact trie of words, and a buildable-word engine
+built on a forward and a reversed trie.
+"""
+import heapq
+import itertools
+import numpy as np
+from sorted_words import SortedWords
+from sorted_words import pack_words
+
+CHUNK_WORDS = 65536
+
+
+class WordTrie(SortedWords):
+    """
+    Trie of a sorted list of words (repeats are
+    dropped), stored as its words in depth-first
+    order (see sorted_words.SortedWords) plus the
+    length of the longest common prefix of each word
+    with the previous one, which gives the branching
+    of the trie.  The offsets and prefix lengths are
+    kept in the smallest integer type that holds
+    them.  The words are read in chunks of
+    chunk_words, so the list may be any sorted
+    iterable.
+    """
+    def __init__(self, sorted_words, chunk_words = CHUNK_WORDS):
+        SortedWords.__init__(self, *_flatten(sorted_words, chunk_words))
+        self._lcp = _adjacent_lcp(self._chars, self._offsets, chunk_words)
+
+    def iter_reversed_words(self, chunk_words = CHUNK_WORDS):
+        """
+        Yields the words reversed, in order of id.
+        """
+        for start in xrange(0, len(self), chunk_words):
+            stop = min(start + chunk_words, len(self))
+            offsets = self._offsets[start:stop + 1]
+            chars = self._chars[offsets[0]:offsets[-1]][::-1].tostring()
+            ends = (offsets[-1] - offsets).tolist()
+            for k in xrange(stop - start):
+                yield chars[ends[k + 1]:ends[k]]
+
+    def prefix_word_ids(self):
+        """
+        Returns an array whose entry i is the id of
+        word i with its last letter removed, or -1
+        if that is not a word.  The words that are
+        prefixes of word i are its ancestors in the
+        trie, which are kept on a stack while walking
+        the words in order.
+        """
+        lengths = self.word_lengths().tolist()
+        lcp = self._lcp.tolist()
+        prefix = np.full(len(self), -1, dtype = np.int32)
+        stack = []
+        for word_id, length in enumerate(lengths):
+            # An ancestor of the previous word is one of this word
+            # if it is no longer than their common prefix.
+            while stack and lengths[stack[-1]] > lcp[word_id]:
+                stack.pop()
+            if stack and lengths[stack[-1]] == length - 1:
+                prefix[word_id] = stack[-1]
+            stack.append(word_id)
+        return prefix
+
+    def nbytes(self):
+        return sum(array.nbytes for array in
+                   [self._chars, self._offsets, self._lcp])
+
+
+def _flatten(sorted_words, chunk_words):
+    """
+    pack_words for a sorted iterable of words, read in
+    chunks, dropping repeated words.
+    """
+    words = iter(sorted_words)
+    chars, offsets = [], [np.zeros(1, dtype = np.int64)]
+    previous = None
+    while True:
+        kept = []
+        for word in itertools.islice(words, chunk_words):
+            if previous is not None and word <= previous:
+                if word == previous:
+                    continue
+                raise ValueError("words are not sorted: %r after %r"
+                                 % (word, previous))
+            kept.append(word)
+            previous = word
+        if len(kept) == 0:
+            break
+        chunk_chars, chunk_offsets = pack_words(kept)
+        chars.append(chunk_chars)
+        offsets.append(chunk_offsets[1:] + offsets[-1][-1])
+    chars = np.concatenate(chars) if chars else np.zeros(0, dtype = np.uint8)
+    offsets = np.concatenate(offsets)
+    return chars, offsets.astype(np.min_scalar_type(offsets[-1]))
+
+
+def _adjacent_lcp(chars, offsets, chunk_words):
+    """
+    Length of the longest common prefix of each word
+    with the previous one (0 for the first word),
+    found by comparing the pairs of adjacent words
+    one letter position at a time, only for the
+    pairs that still agree, chunk_words pairs at a
+    time.
+    """
+    n_words = len(offsets) - 1
+    lengths = np.diff(offsets)
+    lcp = np.zeros(n_words, dtype = np.min_scalar_type(
+        lengths.max() if n_words else 0))
+    for start in xrange(1, n_words, chunk_words):
+        # Pairs (word - 1, word) for the words start, start + 1, ...
+        words = np.arange(start, min(start + chunk_words, n_words))
+        common = np.minimum(lengths[words - 1], lengths[words])
+        words = words[common > 0]
+        position = 0
+        while len(words):
+            same = chars[offsets[words - 1] + position] == \
+                   chars[offsets[words] + position]
+            words = words[same]
+            position += 1
+            lcp[words] = position
+            words = words[np.minimum(lengths[words - 1],
+                                     lengths[words]) > position]
+    return lcp
+
+
+def _sort_words(words, chunk_words = CHUNK_WORDS):
+    """
+    Yields (word, i) for the i-th of words, in sorted
+    order.  Each chunk of chunk_words words is sorted
+    and kept as one string with the offsets of its
+    words rather than as a list of strings, and the
+    chunks are merged.
+    """
+    runs = []
+    words = iter(words)
+    start = 0
+    while True:
+        chunk = list(itertools.islice(words, chunk_words))
+        if len(chunk) == 0:
+            break
+        order = sorted(xrange(len(chunk)), key = chunk.__getitem__)
+        chunk = [chunk[k] for k in order]
+        offsets = np.zeros(len(chunk) + 1, dtype = np.int32)
+        offsets[1:] = np.cumsum([len(word) for word in chunk])
+        runs.append((''.join(chunk), offsets,
+                     np.array(order, dtype = np.int32) + start))
+        start += len(chunk)
+        del chunk, order
+    return heapq.merge(*[_iter_run(*run) for run in runs])
+
+
+def _iter_run(text, offsets, ids):
+    for k in xrange(len(ids)):
+        yield text[offsets.item(k):offsets.item(k + 1)], ids.item(k)
+
+
+class BuildableWords:
+    """
+    Finds the buildable words (see
+    longest_buildable_word.find_buildable_words)
+    using a trie of the words and the parents of the
+    reversed words in their trie.  Removing the last
+    letter of a word leads to its parent in the
+    first trie, and removing the first letter to its
+    parent in the second, so whether each word is
+    buildable is found in one pass over the word
+    lengths.
+    """
+    def __init__(self, words):
+        # Neither the words nor the reversed words are ever held as
+        # one list of strings (see _sort_words).
+        self._trie = WordTrie(word for word, _ in _sort_words(words))
+        self._lengths = self._trie.word_lengths()
+        self._prefix = self._trie.prefix_word_ids()
+        self._suffix = self._suffix_word_ids()
+        self._find_buildable()
+
+    def _suffix_word_ids(self):
+        """
+        Id of each word with its first letter removed,
+        or -1 if that is not a word: the parents in the
+        trie of the reversed words, found while walking
+        the sorted reversed words with a stack of the
+        ones that are prefixes of the current one,
+        without storing that trie.
+        """
+        suffix = np.full(len(self._trie), -1, dtype = np.int32)
+        stack = []
+        for word, word_id in _sort_words(self._trie.iter_reversed_words()):
+            while stack and not word.startswith(stack[-1][0]):
+                stack.pop()
+            if stack and len(stack[-1][0]) == len(word) - 1:
+                suffix[word_id] = stack[-1][1]
+            stack.append((word, word_id))
+        return suffix
+
+    def __contains__(self, word):
+        return self.is_buildable(word)
+
+    def is_buildable(self, word):
+        word_id = self._trie.word_id(word)
+        return word_id >= 0 and self._buildable[word_id]
+
+    def buildable_words(self):
+        """
+        Returns the same dictionary of sets of words
+        of each length as find_buildable_words.
+        """
+        buildable_words = {}
+        for word_id in np.flatnonzero(self._buildable):
+            buildable_words.setdefault(int(self._lengths[word_id]), set()) \
+                           .add(self._trie.word(word_id))
+        return buildable_words
+
+    def max_buildable_words(self):
+        """
+        Returns the set of longest buildable words.
+        """
+        if len(self._trie) == 0:
+            return set()
+        max_length = self._lengths[self._buildable].max()
+        return {self._trie.word(word_id) for word_id
+                in np.flatnonzero(self._buildable &
+                                  (self._lengths == max_length))}
+
+    def get_build_sequence(self, word):
+        """
+        get_build_sequence of longest_buildable_word,
+        walking only the words found buildable.
+        """
+        return self._trie.build_sequence(word, self._prefix, self._suffix,
+                                         self._min_length, self._buildable)
+
+    def _find_buildable(self):
+        self._buildable = np.zeros(len(self._trie), dtype = bool)
+        if len(self._trie) == 0:
+            return
+        self._min_length = self._lengths.min()
+        self._buildable[self._lengths == self._min_length] = True
+        for word_length in range(self._min_length + 1,
+                                 self._lengths.max() + 1):
+            ids = np.flatnonzero(self._lengths == word_length)
+            prefix, suffix = self._prefix[ids], self._suffix[ids]
+            self._buildable[ids] = \
+                ((prefix >= 0) & self._buildable[np.maximum(prefix, 0)]) | \
+                ((suffix >= 0) & self._buildable[np.maximum(suffix, 0)])